@@ -198,7 +198,9 @@ class AdaptiveBase(abc.ABC, ProtocolInterface):
 
         from htmd.parallelprogress import ParallelExecutor
         from htmd.config import _config
-        aprun = ParallelExecutor(n_jobs=_config['njobs'])
+        # Each input is written after reading its whole trajectory piece. Start with the longest pieces
+        cost = [_pieceNumFrames(f) for f in simsframes]
+        aprun = ParallelExecutor(n_jobs=_config['njobs'], cost=cost)
         aprun(total=len(simsframes), desc='Writing inputs')(
             delayed(_writeInputsFunction)(i, f, epoch, self.inputpath, self.coorname) for i, f in enumerate(simsframes))
 
@@ -207,6 +209,13 @@ class AdaptiveBase(abc.ABC, ProtocolInterface):
         return
 
 
+def _pieceNumFrames(f):
+    sim = f.sim if f.sim.parent is None else f.sim.parent
+    if sim.numframes is None or sim.numframes[f.piece] is None:
+        return 0
+    return sim.numframes[f.piece]
+
+
 def _writeInputsFunction(i, f, epoch, inputpath, coorname):
     regex = re.compile('(e\d+s\d+)_')
     frameNum = f.frame
@@ -147,7 +147,7 @@ class AdaptiveBandit(AdaptiveBase):
             goaldata = self._getGoalData(data.simlist)
             if len(data.simlist) != len(goaldata.simlist):
                 raise RuntimeError('The goal function was not able to project all trajectories that the MSM projection could. Check for possible errors in the goal function.')
-            goaldataconcat = np.concatenate(goaldata.dat)
+            goaldataconcat = goaldata._contiguous('projection')
             if self.save:
                 makedirs('saveddata', exist_ok=True)
                 goaldata.save(path.join('saveddata', 'e{}_goaldata.dat'.format(self._getEpoch())))
@@ -204,7 +204,7 @@ class AdaptiveBandit(AdaptiveBase):
             ## For every cluster in data_q, get the max score and initialize
             if self.goal_preprocess is not None:
                 goaldataconcat = self.goal_preprocess(goaldataconcat)
-            qstconcat = np.concatenate(data_q.St)
+            qstconcat = data_q._contiguous('cluster')
             statemaxes = np.zeros(numstates)
             np.maximum.at(statemaxes, qstconcat, np.squeeze(goaldataconcat))
             if not self.pucb:
@@ -320,7 +320,7 @@ class AdaptiveBandit(AdaptiveBase):
 
     def conformationStationaryDistribution(self, model):
         statdist = np.zeros(model.data.numFrames) # zero for disconnected set
-        dataconcatSt = np.concatenate(model.data.St)
+        dataconcatSt = model.data._contiguous('cluster')
         for i in range(model.micronum):
             microframes = np.where(model.micro_ofcluster[dataconcatSt] == i)[0]
             statdist[microframes] = model.msm.stationary_distribution[i]
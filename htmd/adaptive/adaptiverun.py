@@ -83,6 +83,8 @@ class AdaptiveMD(AdaptiveBase):
         Contact symmetry
     save : bool, default=False
         Save the model generated
+    incremental : bool, default=False
+        Reuse the clustering of the previous epoch, assigning only the frames of new simulations to its clusters until the data drifts or grows too much. Only used when ticadim is 0 since TICA changes the projected space in every epoch. When ticadim is larger than 0, TICA uses the native backend and the TICA covariances of previous epochs are stored in `saveddata` so that only those of new simulations are computed.
 
     Example
     -------
@@ -120,6 +122,11 @@ class AdaptiveMD(AdaptiveBase):
         self._arg('ticadim', 'int', 'Number of TICA dimensions to use. When set to 0 it disables TICA', 3, val.Number(int, '0POS'))
         self._arg('contactsym', 'str', 'Contact symmetry', None, val.String())
         self._arg('save', 'bool', 'Save the model generated', False, val.Boolean())
+        self._arg('incremental', 'bool', 'Reuse the clustering of the previous epoch, assigning only the frames of new '
+                  'simulations to its clusters until the data drifts or grows too much. Only used when ticadim is 0 '
+                  'since TICA changes the projected space in every epoch. When ticadim is larger than 0, the TICA '
+                  'covariances of previous epochs are stored in `saveddata` and only those of new simulations are '
+                  'computed.', False, val.Boolean())
 
     def _algorithm(self):
         data = self._getData(self._getSimlist())
@@ -160,7 +167,12 @@ class AdaptiveMD(AdaptiveBase):
             data.dropTraj()  # Drop before TICA to avoid broken trajectories
             ticalag = int(
                 np.ceil(max(2, min(np.min(data.trajLengths) / 2, self.ticalag))))  # 1 < ticalag < (trajLen / 2)
-            tica = TICA(data, ticalag)
+            if self.incremental:  # Only the native TICA backend can reuse the covariances of previous epochs
+                if not path.exists('saveddata'):
+                    makedirs('saveddata')
+                tica = TICA(data, ticalag, backend='native', covfile=path.join('saveddata', 'tica_covariances.dat'))
+            else:
+                tica = TICA(data, ticalag)
             datadr = tica.project(self.ticadim)
         else:
             datadr = metr.project()
@@ -168,7 +180,10 @@ class AdaptiveMD(AdaptiveBase):
         return datadr
 
     def _createMSM(self, data):
-        data.cluster(self.clustmethod(n_clusters=self._numClusters(data.numFrames)))
+        previous = None
+        if self.incremental and self.ticadim == 0 and getattr(self, '_model', None) is not None:
+            previous = self._model.data
+        data.cluster(self.clustmethod(n_clusters=self._numClusters(data.numFrames)), incremental=previous)
         self._model = Model(data)
         self._model.markovModel(self.lag, self._numMacrostates(data))
         if self.save:
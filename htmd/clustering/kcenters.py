@@ -4,6 +4,7 @@
 # No redistribution in whole or part
 #
 import numpy as np
+from numba import njit, prange
 from scipy.spatial.distance import cdist
 from sklearn.base import BaseEstimator, ClusterMixin, TransformerMixin
 import logging
@@ -18,15 +19,24 @@ class KCenter(BaseEstimator, ClusterMixin, TransformerMixin):
     which are closer to the new center than the old one are assigned to the new cluster. This goes on, until K clusters
     have been created.
 
+    The distance updates run in parallel over chunks of frames on single precision data.
+
     Parameters
     ----------
     n_clusters: int
         desired number of clusters
+    chunksize : int
+        Number of frames processed together by each thread when updating the distances to a new center
+    njobs : int
+        Number of threads used by `predict` and `transform`. If None it will use the default from htmd.config.
 
     Examples
     --------
     >>> cluster = KCenter(n_cluster=200)
     >>> cluster.fit(data)
+    >>> cluster = KCenter(n_cluster=300)
+    >>> cluster.fit(newdata, centers=oldcenters)  # Continue adding clusters to existing centers
+    >>> labels = cluster.predict(otherdata)
 
     Attributes
     ----------
@@ -42,21 +52,26 @@ class KCenter(BaseEstimator, ClusterMixin, TransformerMixin):
         list with the distance of each frame from the nearest center
     """
 
-    def __init__(self, n_clusters):
+    def __init__(self, n_clusters, chunksize=4096, njobs=None):
         self.n_clusters = n_clusters
+        self.chunksize = chunksize
+        self.njobs = njobs
         self.cluster_centers_ = []
         self.centerFrames = []
         self.labels_ = []
         self.clusterSize = []
         self.distance = []
 
-    def fit(self, data):
+    def fit(self, data, centers=None):
         """ Compute the centroids of data.
 
         Parameters
         ----------
         data : np.ndarray
             A 2D array of data. Columns are features and rows are data examples.
+        centers : np.ndarray
+            Optionally, existing centers to start from. New centers are added until there are `n_clusters` in total.
+            The existing centers are kept as the first clusters and have a `centerFrames` value of -1.
         """
         if len(self.cluster_centers_) != 0:
             logger.warning('Clustering already exists. Reclustering data!')
@@ -64,42 +79,71 @@ class KCenter(BaseEstimator, ClusterMixin, TransformerMixin):
             self.centerFrames = []
             self.clusterSize = []
 
-        # Initialization
-        # select random point and assign all points to cluster 0
-        numpoints = np.size(data, 0)
+        data = np.atleast_2d(data)
+        # Working copy in single precision. No copy is made if the data is already C-ordered float32
+        data32 = np.ascontiguousarray(data, dtype=np.float32)
+        numpoints = data32.shape[0]
 
-        idxCenter = np.random.randint(numpoints)
-        self.cluster_centers_.append(data[idxCenter, :])
-        self.centerFrames.append(idxCenter)
+        # Squared distance of each frame to its closest center
+        dist = np.full(numpoints, np.inf, dtype=np.float32)
         self.labels_ = np.zeros(numpoints, dtype=int)
 
-        dist = self._dist(self.cluster_centers_, data)
-        countCluster = 1
-
-        while len(self.cluster_centers_) < self.n_clusters:
-            if np.max(dist) == 0:
-                break
+        if centers is not None:
+            centers = np.atleast_2d(centers)
+            seeds = np.ascontiguousarray(centers, dtype=np.float32)
+            for k in range(seeds.shape[0]):
+                newCenterIdx, maxdist = _addCenter(data32, seeds[k], k, dist, self.labels_, self.chunksize)
+            self.centerFrames = [-1] * seeds.shape[0]
+        else:
+            # Initialization
+            # select random point and assign all points to cluster 0
+            idxCenter = np.random.randint(numpoints)
+            newCenterIdx, maxdist = _addCenter(data32, data32[idxCenter], 0, dist, self.labels_, self.chunksize)
+            self.centerFrames = [idxCenter]
 
-            # find point furthest away from all center
-            newCenterIdx = np.argmax(dist)
-            newCenter = data[newCenterIdx, :]
+        while len(self.centerFrames) < self.n_clusters and maxdist > 0:
+            # the point furthest away from all centers becomes the new center and takes the points closer to it
             self.centerFrames.append(newCenterIdx)
-            self.cluster_centers_.append(newCenter)
+            newCenterIdx, maxdist = _addCenter(data32, data32[newCenterIdx], len(self.centerFrames) - 1, dist,
+                                               self.labels_, self.chunksize)
+
+        newcenters = data[[f for f in self.centerFrames if f >= 0], :]
+        if centers is not None:
+            newcenters = np.vstack((centers, newcenters))
+        # update clusterSize
+        self.clusterSize = np.bincount(self.labels_, minlength=len(self.centerFrames))
+        self.distance = np.sqrt(dist)
+        self.cluster_centers_ = newcenters
 
-            # find all points closer to new center than old center
-            newdist = self._dist(newCenter, data)
-            switchIdx = dist > newdist
+    def predict(self, data):
+        """ Assign frames to the closest cluster center
 
-            # assign them to new cluster
-            self.labels_[switchIdx] = countCluster
-            dist[switchIdx] = newdist[switchIdx]
+        Parameters
+        ----------
+        data : np.ndarray
+            A 2D array of data. Columns are features and rows are data examples.
 
-            countCluster += 1
+        Returns
+        -------
+        labels : np.ndarray
+            The index of the closest center to each frame
+        """
+        return _assignCenters(self.cluster_centers_, data, self.njobs)[1]
 
-        # update clusterSize
-        self.clusterSize = np.bincount(self.labels_)
-        self.distance = dist
-        self.cluster_centers_ = np.array(self.cluster_centers_)
+    def transform(self, data):
+        """ Calculate the distance of frames to their closest cluster center
+
+        Parameters
+        ----------
+        data : np.ndarray
+            A 2D array of data. Columns are features and rows are data examples.
+
+        Returns
+        -------
+        distance : np.ndarray
+            The distance of each frame to the closest center
+        """
+        return _assignCenters(self.cluster_centers_, data, self.njobs)[0]
 
     @staticmethod
     def _dist(centers, data):
@@ -107,6 +151,61 @@ class KCenter(BaseEstimator, ClusterMixin, TransformerMixin):
         return dist
 
 
+def _assignCenters(centers, data, njobs=None, chunksize=100000, p=2):
+    """ Finds the closest center to each frame using a KD-tree over the centers.
+
+    Frames are queried in chunks of `chunksize` using `njobs` threads, so the transient double precision copies made by
+    the tree stay bounded. `p` is the Minkowski norm of the distance. Returns float32 distances and the center indexes.
+    """
+    from scipy.spatial import cKDTree
+    if njobs is None:
+        from htmd.util import _getNjobs
+        njobs = _getNjobs()
+
+    data = np.atleast_2d(data)
+    tree = cKDTree(np.atleast_2d(centers))
+    numpoints = data.shape[0]
+    dist = np.empty(numpoints, dtype=np.float32)
+    labels = np.empty(numpoints, dtype=int)
+    for start in range(0, numpoints, chunksize):
+        chunk = np.asarray(data[start:start + chunksize], dtype=np.float32)
+        try:
+            d, i = tree.query(chunk, p=p, workers=njobs)
+        except TypeError:  # Older scipy versions
+            d, i = tree.query(chunk, p=p, n_jobs=njobs)
+        dist[start:start + chunksize] = d
+        labels[start:start + chunksize] = i
+    return dist, labels
+
+
+@njit(parallel=True)
+def _addCenter(data, center, label, dist, labels, chunksize):
+    """ Assigns to `label` all frames closer to `center` than to their current center, updating `dist` (squared
+    distances) and `labels` in place. Returns the index and squared distance of the frame furthest from all centers. """
+    numpoints, numdim = data.shape
+    numchunks = (numpoints + chunksize - 1) // chunksize
+    chunkmax = np.full(numchunks, -1.0)
+    chunkidx = np.zeros(numchunks, dtype=np.int64)
+    for c in prange(numchunks):
+        localmax = -1.0
+        localidx = c * chunksize
+        for i in range(c * chunksize, min(numpoints, (c + 1) * chunksize)):
+            d = 0.0
+            for j in range(numdim):
+                diff = data[i, j] - center[j]
+                d += diff * diff
+            if d < dist[i]:
+                dist[i] = d
+                labels[i] = label
+            if dist[i] > localmax:
+                localmax = dist[i]
+                localidx = i
+        chunkmax[c] = localmax
+        chunkidx[c] = localidx
+    best = np.argmax(chunkmax)
+    return chunkidx[best], chunkmax[best]
+
+
 if __name__ == '__main__':
     """
     infile = open("../../clusterdata/R15.txt")
@@ -129,6 +228,28 @@ if __name__ == '__main__':
 
     cluster1 = KCenter(n_clusters=20)
     cluster1.fit(data)
+    assert cluster1.cluster_centers_.shape == (20, 10)
+    assert np.array_equal(cluster1.labels_, np.argmin(cdist(data, cluster1.cluster_centers_), axis=1))
+    assert np.allclose(cluster1.distance, np.min(cdist(data, cluster1.cluster_centers_), axis=1), atol=1e-5)
+    assert np.sum(cluster1.clusterSize) == 100
+
+    # Farthest point selection: each new center was the furthest point from all previous centers
+    for k in range(2, 20):
+        prev = cdist(data, data[cluster1.centerFrames[:k]]).min(axis=1)
+        assert np.isclose(prev[cluster1.centerFrames[k]], prev.max(), atol=1e-5)
+
+    cluster2 = KCenter(n_clusters=30, chunksize=7)
+    cluster2.fit(data, centers=cluster1.cluster_centers_)
+    assert cluster2.cluster_centers_.shape == (30, 10)
+    assert np.array_equal(cluster2.cluster_centers_[:20], cluster1.cluster_centers_)
+    assert np.array_equal(cluster2.labels_, np.argmin(cdist(data, cluster2.cluster_centers_), axis=1))
+
+    newdata = np.random.rand(1000, 10)
+    cluster2.njobs = 2
+    assert np.array_equal(cluster2.predict(newdata), np.argmin(cdist(newdata, cluster2.cluster_centers_), axis=1))
+    assert np.allclose(cluster2.transform(newdata), np.min(cdist(newdata, cluster2.cluster_centers_), axis=1), atol=1e-5)
+    dist, labels = _assignCenters(cluster2.cluster_centers_, newdata, njobs=2, chunksize=33)
+    assert np.array_equal(labels, cluster2.predict(newdata))
 
     """
     from matplotlib import pylab as plt
@@ -25,6 +25,8 @@ class RegCluster(BaseEstimator, ClusterMixin, TransformerMixin):
         radius of clusters
     n_clusters: int
         desired number of clusters
+    njobs : int
+        Number of threads used by `predict` and `transform`. If None it will use the default from htmd.config.
 
     Examples
     --------
@@ -42,12 +44,13 @@ class RegCluster(BaseEstimator, ClusterMixin, TransformerMixin):
     clusterSize_ : list
         list with number of frames in each cluster
     """
-    def __init__(self, radius=None, n_clusters=None):
+    def __init__(self, radius=None, n_clusters=None, njobs=None):
         if radius is None and n_clusters is None:
             raise RuntimeError("radius or n_clusters needs to be set")
 
         self.radius = radius
         self.n_clusters = n_clusters
+        self.njobs = njobs
         self.labels_ = []
 
     def fit(self, data):
@@ -72,6 +75,38 @@ class RegCluster(BaseEstimator, ClusterMixin, TransformerMixin):
         self._reg = RegularSpaceClustering(dmin=self.radius)
         self.labels_ = self._reg.fit_transform(data).flatten()
 
+    def predict(self, data):
+        """ Assign frames to the closest cluster center
+
+        Parameters
+        ----------
+        data : np.ndarray
+            array of data points to assign
+
+        Returns
+        -------
+        labels : np.ndarray
+            The index of the closest center to each frame
+        """
+        from htmd.clustering.kcenters import _assignCenters
+        return _assignCenters(self.cluster_centers_, data, self.njobs)[1]
+
+    def transform(self, data):
+        """ Calculate the distance of frames to their closest cluster center
+
+        Parameters
+        ----------
+        data : np.ndarray
+            array of data points
+
+        Returns
+        -------
+        distance : np.ndarray
+            The distance of each frame to the closest center
+        """
+        from htmd.clustering.kcenters import _assignCenters
+        return _assignCenters(self.cluster_centers_, data, self.njobs)[0]
+
     @property
     def cluster_centers_(self):
         return self._reg.clustercenters
@@ -165,13 +165,7 @@ class Kinetics(object):
             r = Rates()
             return r
 
-        if self.source in source:  # Apply concentration only on the bulk state
-            conc = self.concentration
-        elif self.source in sink:  # Invert concentration is bulk state is in sink
-            if _logger: logger.info('Bulk state detected in sink. Applying concentration correction to sink instead of source.')
-            conc = 1 / self.concentration
-        else:
-            conc = 1
+        conc = self._concentration(source, sink, _logger)
 
         model = self.model
         if states == 'macro':  # Finding the microstates of the macrostates
@@ -203,6 +197,130 @@ class Kinetics(object):
         r.kdeq = np.exp(r.g0eq / self._kBT)
         return r
 
+    def _concentration(self, source, sink, _logger=True):
+        if self.source in source:  # Apply concentration only on the bulk state
+            return self.concentration
+        elif self.source in sink:  # Invert concentration is bulk state is in sink
+            if _logger: logger.info('Bulk state detected in sink. Applying concentration correction to sink instead of source.')
+            return 1 / self.concentration
+        return 1
+
+    def bootstrap(self, numsamples=100, source=None, sink=None, states='macro', nits=None, ratio=1, njobs=None,
+                  seed=None):
+        """ Bootstraps the implied timescales, equilibrium probabilities and rates over the trajectories
+
+        Each sample draws trajectories with replacement and estimates a reversible MSM from the sum of their count
+        matrices, keeping the clustering and the macrostates of the model fixed. The count matrices of the trajectories
+        are computed only once and the samples are estimated in parallel.
+
+        Parameters
+        ----------
+        numsamples : int
+            Number of bootstrap samples
+        source : int, optional
+            The state index to use as source
+        sink : int, optional
+            The state index to use as sink
+        states : ['macro','micro'], optional
+            The state type of the states given before
+        nits : int
+            Number of implied timescales to calculate. Default: the number of macrostates
+        ratio : float
+            The number of trajectories drawn in each sample as a ratio of the total number of trajectories
+        njobs : int
+            Number of parallel jobs to spawn. If None it will use the default from htmd.config.
+        seed : int
+            Seed of the random trajectory sampling
+
+        Returns
+        -------
+        boot : :class:`BootstrapRates` object
+            The values of all bootstrap samples
+
+        Example
+        -------
+        >>> kin = Kinetics(model, temperature=300, concentration=0.015)
+        >>> boot = kin.bootstrap(200)
+        >>> print(boot)
+        >>> np.percentile(boot.koff, [5, 95])
+        """
+        import numbers
+        from htmd.model import _bootstrapReplicates
+        from htmd.parallelprogress import ParallelExecutor, delayed
+        from htmd.util import _getNjobs
+        self._intergrityCheck()
+        if source is None:
+            source = self.source
+        if sink is None:
+            sink = self.sink
+        if isinstance(source, numbers.Integral):
+            source = [source, ]
+        if isinstance(sink, numbers.Integral):
+            sink = [sink, ]
+        if len(source) == 0 or len(sink) == 0:
+            raise ValueError('The source and sink states cannot be empty')
+        if len(np.intersect1d(source, sink)) != 0:
+            logger.info('Calculating rates between state and itself gives 0')
+            return BootstrapRates()
+        conc = self._concentration(source, sink)
+        njobs = njobs if njobs is not None else _getNjobs()
+
+        model = self.model
+        if nits is None:
+            nits = model.macronum
+        if states == 'macro':
+            sourceclusters = np.flatnonzero(np.isin(model.macro_ofcluster, source))
+            sinkclusters = np.flatnonzero(np.isin(model.macro_ofcluster, sink))
+        elif states == 'micro':
+            sourceclusters = model.cluster_ofmicro[source]
+            sinkclusters = model.cluster_ofmicro[sink]
+        else:
+            raise ValueError('states must be either \'macro\' or \'micro\'')
+
+        # Macrostate membership probabilities of the clusters. Clusters outside the model's active set have none.
+        macroindexes = sorted(set(model.msm.metastable_assignments))
+        memberships = np.zeros((model.data.K, model.macronum))
+        memberships[model.cluster_ofmicro] = model.msm.metastable_memberships[:, macroindexes]
+
+        counts = model._trajectoryCountMatrices(model.lag)
+        numtraj = counts.shape[0]
+        rng = np.random.RandomState(seed)
+        weights = np.vstack([np.bincount(rng.randint(numtraj, size=int(np.floor(numtraj * ratio))), minlength=numtraj)
+                             for _ in range(numsamples)])
+
+        batches = np.array_split(np.arange(numsamples), min(numsamples, max(1, njobs) * 4))
+        aprun = ParallelExecutor(n_jobs=njobs)
+        results = aprun(total=len(batches), desc='Bootstrapping')(
+            delayed(_bootstrapReplicates)(counts, weights[b], model.data.K, model.lag, nits, memberships, sourceclusters,
+                                          sinkclusters) for b in batches)
+        timescales, macroeq, mfpton, mfptoff = [np.concatenate(x) for x in zip(*results)]
+
+        # Samples which do not contain both the source and the sink have no rates. Keep them as NaN instead of inf.
+        degenerate = ~(mfpton > 0) | ~(mfptoff > 0)
+        if states == 'macro':
+            sinkeq = np.sum(macroeq[:, sink], axis=1)
+            sourceeq = np.sum(macroeq[:, source], axis=1)
+            degenerate |= ~(sinkeq > 0) | ~(sourceeq > 0)
+        if np.any(degenerate):
+            logger.warning('{} of {} bootstrap samples do not contain both the source and sink states. Their rates '
+                           'are set to NaN.'.format(np.sum(degenerate), numsamples))
+            mfpton[degenerate] = np.nan
+            mfptoff[degenerate] = np.nan
+
+        boot = BootstrapRates()
+        boot.timescales = timescales * model.data.fstep
+        boot.eq = macroeq
+        boot.mfpton = model.data.fstep * model.lag * mfpton
+        boot.mfptoff = model.data.fstep * model.lag * mfptoff
+        boot.koff = 1E9 / boot.mfptoff
+        boot.kon = 1E9 / (boot.mfpton * conc)
+        if states == 'macro':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                boot.g0eq = -self._kBT * np.log(sinkeq / (conc * sourceeq))
+            boot.g0eq[degenerate] = np.nan
+            boot.kdeq = np.exp(boot.g0eq / self._kBT)
+        return boot
+
     def plotRates(self, rates=('mfptoff', 'mfpton', 'g0eq')):
         """ Plot the MFPT on, off and DG of all the macrostates to the sink state
 
@@ -400,3 +518,51 @@ class Rates(object):
         s += 'kdeq = {:.2E} (M)\n'.format(self.kdeq)
         s += 'g0eq = {:.2f} (kcal/M)\n'.format(self.g0eq)
         return s
+
+
+class BootstrapRates(object):
+    """ The values of timescales, equilibrium probabilities and rates over bootstrap samples
+
+    Created by :meth:`Kinetics.bootstrap`. Each attribute has the samples in its first dimension. Samples in which a
+    value could not be estimated (i.e. the source or sink were not sampled) contain NaN.
+
+    Attributes
+    ----------
+    timescales : np.ndarray
+        The implied timescales in ns. 2D array with dimensions (numsamples, nits)
+    eq : np.ndarray
+        The equilibrium probabilities of the macrostates. 2D array with dimensions (numsamples, macronum)
+    mfpton : np.ndarray
+        The mean first passage time of going from source to sink
+    mfptoff : np.ndarray
+        The mean first passage time of going from sink to source
+    kon : np.ndarray
+        The Kon rate (association constant) from source to sink
+    koff : np.ndarray
+        The Koff rate (dissociation constant) from sink to source
+    kdeq : np.ndarray
+        The Kd, calculated from the equilibrium probability. None if the rates are between microstates.
+    g0eq : np.ndarray
+        The free energy between source and sink, calculated from the equilibrium probability. None if the rates are
+        between microstates.
+    """
+    def __init__(self):
+        self.timescales = None
+        self.eq = None
+        self.mfpton = None
+        self.mfptoff = None
+        self.kon = None
+        self.koff = None
+        self.kdeq = None
+        self.g0eq = None
+
+    def __repr__(self):
+        units = (('mfpton', '(ns)'), ('mfptoff', '(ns)'), ('kon', '(1/M 1/s)'), ('koff', '(1/s)'), ('kdeq', '(M)'),
+                 ('g0eq', '(kcal/mol)'))
+        s = ''
+        for name, unit in units:
+            values = self.__dict__[name]
+            if values is None:
+                continue
+            s += '{} = {:.2E} +- {:.2E} {}\n'.format(name, np.nanmean(values), np.nanstd(values), unit)
+        return s
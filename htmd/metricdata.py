@@ -7,6 +7,7 @@ import numpy as np
 import random
 from copy import deepcopy
 import pickle
+from collections import OrderedDict
 import logging
 logger = logging.getLogger(__name__)
 
@@ -19,16 +20,164 @@ def _getsizes(x):
             return len(x)
 
 
+class _ProjectionStore(object):
+    """ Reads trajectory projections on demand from a contiguous .npy file, keeping the `cachesize` most recently
+    accessed trajectories in memory. """
+    def __init__(self, filename, offsets, cachesize=100):
+        self.filename = filename
+        self.offsets = offsets
+        self.cachesize = cachesize
+        self._open()
+
+    def _open(self):
+        import threading
+        self._data = np.load(self.filename, mmap_mode='r')
+        self.dtype = self._data.dtype
+        self.framedims = self._data.shape[1:]
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, i):
+        with self._lock:
+            if i in self._resident:
+                self._resident.move_to_end(i)
+                return self._resident[i]
+            arr = np.array(self._data[self.offsets[i]:self.offsets[i + 1]])
+            arr.flags.writeable = False  # In-place changes would be lost when the trajectory is evicted
+            self._resident[i] = arr
+            while len(self._resident) > self.cachesize:
+                self._resident.popitem(last=False)
+            return arr
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'offsets': self.offsets, 'cachesize': self.cachesize}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def __deepcopy__(self, memo):
+        return self  # Read-only, can be shared between copies
+
+
+class _LazyProjection(object):
+    """ Placeholder for a trajectory projection which is read from a :class:`_ProjectionStore` when accessed """
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.shape = (int(store.offsets[index + 1] - store.offsets[index]),) + store.framedims
+        self.dtype = store.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def resolve(self):
+        return self.store.get(self.index)
+
+
+class _ConcatenatedView(object):
+    """ Row indexing over the projections of all trajectories of a MetricData object as if they were concatenated,
+    without concatenating them. Only the trajectories containing the requested rows are read. """
+    def __init__(self, data):
+        self._trajectories = data.trajectories
+        self._lengths = np.asarray(data.trajLengths)
+        self._ends = np.cumsum(self._lengths)
+        self.shape = (int(self._ends[-1]) if len(self._ends) else 0, data.numDimensions)
+        self.dtype = data.trajectories[0]._projection.dtype
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if isinstance(key[0], slice) and key[0].indices(self.shape[0])[2] > 0:
+            return self._readSlice(*key[0].indices(self.shape[0]))[(slice(None),) + key[1:]]
+        rows = self._rows(key[0])
+        scalar = np.ndim(rows) == 0
+        rows = np.atleast_1d(rows)
+        # Map the rows to (trajectory, offset) and read each trajectory once
+        traj = np.searchsorted(self._ends, rows, side='right')
+        offsets = rows - (self._ends[traj] - self._lengths[traj])
+        out = np.empty((len(rows), self.shape[1]), dtype=self.dtype)
+        order = np.argsort(traj, kind='stable')
+        uqtraj, first = np.unique(traj[order], return_index=True)
+        for t, idx in zip(uqtraj, np.split(order, first[1:])):
+            out[idx] = self._trajectories[t].projection[offsets[idx]]
+        if scalar:
+            return out[0][key[1:]]
+        return out[(slice(None),) + key[1:]]
+
+    def _rows(self, key):
+        """ The absolute rows selected by an integer, integer array, boolean mask or negative step slice """
+        n = self.shape[0]
+        if isinstance(key, slice):
+            return np.arange(*key.indices(n))
+        rows = np.asarray(key)
+        if rows.dtype == bool:
+            if rows.shape != (n,):
+                raise IndexError('Boolean index of shape {} does not match {} rows'.format(rows.shape, n))
+            return np.flatnonzero(rows)
+        if np.any(rows < -n) or np.any(rows >= n):
+            raise IndexError('Row index out of bounds for {} rows'.format(n))
+        return np.where(rows < 0, rows + n, rows)
+
+    def _readSlice(self, start, stop, step):
+        """ The rows of a positive step slice, read as slices of the trajectories it spans """
+        parts = []
+        t = np.searchsorted(self._ends, start, side='right')
+        while start < stop:
+            tstart = self._ends[t] - self._lengths[t]
+            end = min(stop, self._ends[t])
+            parts.append(self._trajectories[t].projection[start - tstart:end - tstart:step])
+            start += -(-(end - start) // step) * step  # First row of the slice after this trajectory
+            t = np.searchsorted(self._ends, start, side='right')
+        if len(parts) == 0:
+            return np.empty((0, self.shape[1]), dtype=self.dtype)
+        return np.concatenate(parts)
+
+
+class _StateIndex(object):
+    """ CSR-style inverted index from states to the sorted absolute frames assigned to them
+
+    Built in a single pass over the frame labels. Frames with negative labels (i.e. states outside of the model) are
+    not indexed.
+    """
+    def __init__(self, labels, numstates=None):
+        labels = np.asarray(labels)
+        valid = labels >= 0
+        if numstates is None:
+            numstates = int(labels.max()) + 1 if np.any(valid) else 0
+        order = np.argsort(labels, kind='stable')  # Stable sort keeps the frames of each state sorted
+        self.frames = order[len(labels) - np.count_nonzero(valid):]
+        self.indptr = np.append(0, np.cumsum(np.bincount(labels[valid], minlength=numstates)))
+
+    @property
+    def numStates(self):
+        return len(self.indptr) - 1
+
+    def counts(self):
+        return np.diff(self.indptr)
+
+    def get(self, state):
+        if state < 0 or state >= self.numStates:
+            return self.frames[:0]
+        return self.frames[self.indptr[state]:self.indptr[state + 1]]
+
+
 class Trajectory(object):
     def __init__(self, projection=None, reference=None, sim=None, cluster=None):
         self._projection = projection
         self._reference = reference
         self._cluster = cluster
         self.sim = sim
-        self._checkframes((self.projection, self.reference, self.cluster))
+        self._checkframes((self._projection, self.reference, self.cluster))
 
     @property
     def projection(self):
+        if isinstance(self._projection, _LazyProjection):
+            return self._projection.resolve()
         return self._projection
 
     @projection.setter
@@ -42,7 +191,7 @@ class Trajectory(object):
 
     @reference.setter
     def reference(self, value):
-        self._checkframes((self.projection, value, self.cluster))
+        self._checkframes((self._projection, value, self.cluster))
         self._reference = value
 
     @property
@@ -51,16 +200,16 @@ class Trajectory(object):
 
     @cluster.setter
     def cluster(self, value):
-        self._checkframes((self.projection, self.reference, value))
+        self._checkframes((self._projection, self.reference, value))
         self._cluster = value
 
     @property
     def numFrames(self):
-        return self.projection.shape[0]
+        return self._projection.shape[0]
 
     @property
     def numDimensions(self):
-        return self.projection.shape[1]
+        return self._projection.shape[1]
 
     def _numframes(self, args):
         return np.unique([x for x in list(map(_getsizes, args)) if x is not None])
@@ -73,12 +222,12 @@ class Trajectory(object):
         if np.min(frames) < 0 or np.max(frames) >= self.numFrames:
             raise RuntimeError('Frames to drop must be > 0 and < {}'.format(self.numFrames))
         if self._projection is not None:
-            self._projection = np.delete(self._projection, frames, axis=0)
+            self._projection = np.delete(self.projection, frames, axis=0)
         if self._reference is not None:
             self._reference = np.delete(self._reference, frames, axis=0)
         if self._cluster is not None:
             self._cluster = np.delete(self._cluster, frames, axis=0)
-        self._checkframes((self.projection, self.reference, self.cluster))
+        self._checkframes((self._projection, self.reference, self.cluster))
 
     def copy(self):
         return deepcopy(self)
@@ -90,7 +239,7 @@ class Trajectory(object):
     def __str__(self):
         return 'sim: {}\nprojection: {}\nreference: {}\ncluster: {}\n'.format(
             'simid = {}'.format(self.sim.simid) if self.sim is not None else None,
-            'np.array(shape={})'.format(np.shape(self.projection)) if self.projection is not None else None,
+            'np.array(shape={})'.format(self._projection.shape) if self._projection is not None else None,
             'np.array(shape={})'.format(np.shape(self.reference)) if self.reference is not None else None,
             'np.array(shape={})'.format(np.shape(self.cluster)) if self.cluster is not None else None)
 
@@ -136,14 +285,26 @@ class MetricData(object):
         self.K = None
         self.N = None
         self.Centers = None
+        self._storage = {}
+        self._clusterindex = None
 
         if file is not None:
             self.load(file)
 
         self._dataid = random.random()
         self._clusterid = None
+        self._clusterstats = None
         return
 
+    def __getstate__(self):
+        # The contiguous storage and the state index duplicate the trajectory data when pickled. They are rebuilt on demand.
+        return {k: v for k, v in self.__dict__.items() if k not in _TRANSIENT}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._storage = {}
+        self._clusterindex = None
+
     def _loadTrajectories(self, projection=None, reference=None, simlist=None, cluster=None):
         size = np.unique([x for x in list(map(_getsizes, (projection, reference, simlist, cluster))) if x is not None])
         if len(size) == 0:
@@ -248,7 +409,8 @@ class MetricData(object):
         if self.fstep > 0:
             return self.numFrames * self.fstep
 
-    def cluster(self, clusterobj, mergesmall=None, batchsize=False):
+    def cluster(self, clusterobj, mergesmall=None, batchsize=False, incremental=None, maxdrift=1.5, maxgrowth=0.5,
+                fitframes=None, fitstride=None, njobs=None):
         """ Cluster the metrics
 
         Parameters
@@ -257,36 +419,68 @@ class MetricData(object):
             The object of a clustering class from sklearn or with the same interface
         mergesmall : int
             Clusters containing less than `mergesmall` conformations will be joined into their closest well-populated
-            neighbour.
+            neighbour. Ignored when the frames are assigned to the clusters of `incremental`, which keep the merging
+            of the clustering they come from.
         batchsize : int
             Batch sizes bigger than 0 will enable batching.
+        incremental : :class:`MetricData` object
+            A previously clustered MetricData of the same projection, i.e. from the last adaptive epoch. Trajectories
+            which were already clustered in it keep their cluster assignments and only the frames of new trajectories
+            are assigned to its closest cluster centers. A full clustering with `clusterobj` is done instead if one of
+            the `maxdrift` or `maxgrowth` criteria is met.
+        maxdrift : float
+            Refit if the mean distance of the new frames to their closest center is more than `maxdrift` times the
+            mean distance measured when the clusters were fitted.
+        maxgrowth : float
+            Refit if the number of frames added since the clusters were fitted is more than `maxgrowth` times the
+            number of frames used in the fit.
+        fitframes : int
+            Fit the clustering on a random subset of `fitframes` frames and then assign all frames with the `predict`
+            method of `clusterobj`.
+        fitstride : int
+            Fit the clustering on every `fitstride`-th frame and then assign all frames with the `predict` method of
+            `clusterobj`. Can be combined with `fitframes`.
+        njobs : int
+            Number of threads used to assign frames after fitting on a subset or in batches. If None it will use the
+            default from htmd.config.
 
         Examples
         --------
         >>> from sklearn.cluster import MiniBatchKMeans
         >>> data = MetricDistance.project(sims, 'protein and name CA', 'resname MOL')
         >>> data.cluster(MiniBatchKMeans(n_clusters=1000), mergesmall=5)
+        >>> newdata.cluster(MiniBatchKMeans(n_clusters=1000), incremental=data)
+        >>> data.cluster(MiniBatchKMeans(n_clusters=1000), fitframes=200000)
         """
+        if incremental is not None:
+            if self._updateClustering(incremental, maxdrift, maxgrowth):
+                return
+            logger.info('Refitting the clustering on all data.')
+
         #cluster_obj = coor.cluster_kmeans(self.dat, k=20, stride=1)
         if batchsize > 0:
-            lengths = self.trajLengths
-            currsum = 0
-            starts = [0]
-            for i, l in enumerate(lengths):
-                currsum += l
-                if currsum > batchsize:
-                    starts.append(i+1)
-                    currsum = 0
-            starts.append(self.numTrajectories)
-            for i in range(len(starts) - 1):
-                clusterobj.partial_fit(np.concatenate(self.dat[starts[i]:starts[i+1]]))
-            labels = []
-            for i in range(self.numTrajectories):
-                labels.append(clusterobj.predict(self.dat[i].astype(np.float32)))
-            # This is retarded
-            labels = np.concatenate(labels)
+            from tqdm import tqdm
+            for chunk in tqdm(self._iterChunks(batchsize), desc='Fitting clusters'):
+                clusterobj.partial_fit(chunk)
+            labels = self._predictChunked(clusterobj, chunksize=max(batchsize, 10000), njobs=njobs)
+            datconcat = self._concatenated()
+        elif fitframes is not None or fitstride is not None:
+            if not hasattr(clusterobj, 'predict'):
+                raise AttributeError('Fitting on a subset of frames requires a clustering object with a predict method.')
+            datconcat = self._concatenated()
+            fitidx = np.arange(0, self.numFrames, fitstride if fitstride is not None else 1)
+            if fitframes is not None and len(fitidx) > fitframes:
+                fitidx = np.sort(np.random.choice(fitidx, fitframes, replace=False))
+            logger.info('Fitting the clustering on {} of {} frames.'.format(len(fitidx), self.numFrames))
+            import warnings
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                clusterobj.fit(np.asarray(datconcat[fitidx]))
+            labels = self._predictChunked(clusterobj, njobs=njobs)
         else:
-            datconcat = np.concatenate(self.dat)
+            if self._isLazy():
+                logger.warning('Clustering without batchsize reads all lazily loaded projections into memory.')
+            datconcat = self._contiguous('projection')
             if np.ndim(datconcat) == 1:
                 datconcat = np.transpose(np.atleast_2d(datconcat))
             import warnings  # Following 3 lines are BS because sklearn refuse to make releases more often than 1 per year...
@@ -303,20 +497,157 @@ class MetricData(object):
         map[uqclu] = range(self.K)
         labels = map[labels]
         # ------------------------------------
-        for i, s in enumerate(self.deconcatenate(labels)):
-            self.trajectories[i].cluster = s
+        self._setContiguous('cluster', labels)
         self.N = np.bincount(labels)
 
         if mergesmall is not None:
             oldK = self.K
             self.K, St, self.Centers, self.N, xxx = _mergeSmallClusters(mergesmall, datconcat, labels, self.Centers, self.N)
-            for i, s in enumerate(self.deconcatenate(St)):
-                self.trajectories[i].cluster = s
+            self._setContiguous('cluster', St)
             logger.info('Mergesmall removed {} clusters. Original ncluster {}, new ncluster {}.'.format(oldK-self.K, oldK, self.K))
 
+        # Reference statistics of the fit for incremental clustering. The mean distance is only estimated once the
+        # clustering is used incrementally, see _fitStatistics
+        self._clusterstats = (int(self.numFrames), None)
+
         self._dataid = random.random()
         self._clusterid = self._dataid
-    
+
+    def _updateClustering(self, previous, maxdrift, maxgrowth):
+        """ Assigns the trajectories to the clusters of a previously clustered MetricData. Returns False if the
+        clustering needs to be refitted. """
+        from htmd.clustering.kcenters import _assignCenters
+        if previous.Centers is None or getattr(previous, '_clusterstats', None) is None:
+            return False
+        if np.shape(previous.Centers)[1] != self.numDimensions:
+            logger.warning('Cannot cluster incrementally data with a different number of dimensions.')
+            return False
+        fitframes = previous._clusterstats[0]
+        if self.numFrames - fitframes > maxgrowth * fitframes:
+            logger.info('Data grew by more than {:.0%} since the clusters were fitted.'.format(maxgrowth))
+            return False
+
+        # Trajectories are matched by their trajectory files and number of frames
+        prevlabels = {}
+        for t in previous.trajectories:
+            if t.cluster is not None and t.sim is not None:
+                prevlabels[(tuple(t.sim.trajectory), t.numFrames)] = t.cluster
+
+        labels = []
+        newtraj = []
+        for i, t in enumerate(self.trajectories):
+            key = (tuple(t.sim.trajectory), t.numFrames) if t.sim is not None else None
+            if key in prevlabels:
+                labels.append(prevlabels[key])
+            else:
+                labels.append(None)
+                newtraj.append(i)
+
+        if len(newtraj) != 0:
+            newdata = np.concatenate([self.trajectories[i].projection for i in newtraj])
+            dist, newlabels = _assignCenters(previous.Centers, newdata, p=_minkowskiNorm(newdata))
+            fitdist = previous._fitStatistics()[1]
+            if np.mean(dist) > maxdrift * fitdist:
+                logger.info('New frames are on average {:.2f} times further from the cluster centers than the fitted '
+                            'frames.'.format(np.mean(dist) / fitdist))
+                return False
+            for i, l in zip(newtraj, np.split(newlabels, np.cumsum([self.trajectories[i].numFrames for i in newtraj])[:-1])):
+                labels[i] = l
+
+        self._setContiguous('cluster', np.concatenate(labels))
+        self.Centers = previous.Centers
+        self.K = len(self.Centers)
+        self.N = np.bincount(self._contiguous('cluster'), minlength=self.K)
+        self._clusterstats = previous._clusterstats
+        self._dataid = random.random()
+        self._clusterid = self._dataid
+        logger.info('Assigned {} new trajectories to the existing {} clusters.'.format(len(newtraj), self.K))
+        return True
+
+    def _fitStatistics(self):
+        """ The number of frames the clusters were fitted on and the mean distance of the frames to their closest
+        center. The distance is estimated on a subset of the frames on first use and stored. """
+        fitframes, fitdist = self._clusterstats
+        if fitdist is None:
+            from htmd.clustering.kcenters import _assignCenters
+            datconcat = self._concatenated()
+            sample = np.sort(np.random.choice(self.numFrames, min(self.numFrames, 100000), replace=False))
+            dist, _ = _assignCenters(self.Centers, np.asarray(datconcat[sample]), p=_minkowskiNorm(datconcat))
+            fitdist = float(np.mean(dist))
+            self._clusterstats = (fitframes, fitdist)
+        return fitframes, fitdist
+
+    def _predictChunked(self, clusterobj, chunksize=100000, njobs=None):
+        """ Assigns all frames with `clusterobj.predict` on fixed-size chunks which cross trajectory boundaries. The
+        chunks are views of the contiguous data predicted in parallel threads. """
+        from htmd.parallelprogress import ParallelExecutor, delayed
+        if njobs is None:
+            from htmd.util import _getNjobs
+            njobs = _getNjobs()
+        datconcat = self._concatenated()
+        starts = range(0, self.numFrames, chunksize)
+        aprun = ParallelExecutor(n_jobs=njobs, backend='threads')
+        labels = aprun(total=len(starts), desc='Assigning clusters')(
+            delayed(_predictChunk)(clusterobj, datconcat, s, chunksize) for s in starts)
+        return np.concatenate(labels)
+
+    def _isLazy(self):
+        return np.any([isinstance(t._projection, _LazyProjection) for t in self.trajectories])
+
+    def _concatenated(self):
+        """ The projections of all trajectories concatenated. For lazily loaded data a :class:`_ConcatenatedView` is
+        returned instead which reads only the indexed frames. """
+        if self._isLazy():
+            return _ConcatenatedView(self)
+        return self._contiguous('projection')
+
+    def _contiguous(self, field):
+        """ The `field` ('projection', 'reference' or 'cluster') of all trajectories as a single contiguous array.
+
+        The trajectories are re-pointed to views into the array, so it is only rebuilt after a trajectory was modified.
+        The array is shared with the trajectories and should not be modified in place.
+        """
+        attr = '_' + field
+        if field in self._storage:
+            array, views = self._storage[field]
+            if len(views) == self.numTrajectories and \
+                    np.all([getattr(t, attr) is v for t, v in zip(self.trajectories, views)]):
+                return array
+        array = np.concatenate([getattr(t, field) for t in self.trajectories])
+        if field == 'projection' and self._isLazy():
+            return array  # Don't replace the lazy placeholders with in-memory views
+        self._setContiguous(field, array)
+        return array
+
+    def _clusterIndex(self):
+        """ A :class:`_StateIndex` of the frames of each cluster, rebuilt only when the clustering changes """
+        labels = self._contiguous('cluster')
+        if self._clusterindex is None or self._clusterindex[0] != self._clusterid or self._clusterindex[1] is not labels:
+            self._clusterindex = (self._clusterid, labels, _StateIndex(labels, self.K))
+        return self._clusterindex[2]
+
+    def _setContiguous(self, field, array):
+        """ Stores a contiguous array of all frames and sets the `field` of each trajectory to a view into it """
+        offsets = np.append(0, np.cumsum(self.trajLengths))
+        views = [array[offsets[i]:offsets[i + 1]] for i in range(self.numTrajectories)]
+        for t, v in zip(self.trajectories, views):
+            t.__dict__['_' + field] = v
+        self._storage[field] = (array, views)
+
+    def _iterChunks(self, chunksize):
+        """ Yields the projections of consecutive trajectories concatenated in chunks of about `chunksize` frames """
+        currsum = 0
+        starts = [0]
+        for i, l in enumerate(self.trajLengths):
+            currsum += l
+            if currsum > chunksize:
+                starts.append(i+1)
+                currsum = 0
+        if starts[-1] != self.numTrajectories:
+            starts.append(self.numTrajectories)
+        for i in range(len(starts) - 1):
+            yield np.concatenate([t.projection for t in self.trajectories[starts[i]:starts[i+1]]])
+
     def combine(self, otherdata):
         """ Combines two different metrics into one by concatenating them.
 
@@ -497,14 +828,14 @@ class MetricData(object):
         if frames is None or isinstance(frames, int):
             frames = np.repeat(frames, len(clusters))
 
-        stConcat = np.concatenate(self.St)
+        index = self._clusterIndex()
         absFrames = []
         relFrames = []
         for i in range(len(clusters)):
             if frames[i] == 0 and not allframes:
                 continue
             st = clusters[i]
-            absFrames.append(_sampleCluster(st, stConcat, frames[i], replacement))
+            absFrames.append(_randomSample(index.get(st), frames[i], replacement))
             if len(absFrames[-1]) == 0:
                 raise NameError('No frames could be sampled from cluster {}. Cluster is empty.'.format(st))
 
@@ -571,9 +902,13 @@ class MetricData(object):
     def deconcatenate(self, array):
         indeces = np.cumsum(self.trajLengths)
         if np.ndim(array) == 1:
-            return np.array(np.split(array, indeces[:-1]))
+            parts = np.split(array, indeces[:-1])
         else:
-            return np.array(np.vsplit(array, indeces[:-1]))
+            parts = np.vsplit(array, indeces[:-1])
+        ret = np.empty(len(parts), dtype=object)
+        for i, p in enumerate(parts):  # Assign one by one to avoid numpy stacking equal-length trajectories
+            ret[i] = p
+        return ret
 
     def abs2rel(self, absFrames):
         """ Convert absolute frame indexes into trajectory index-frame pairs
@@ -595,17 +930,51 @@ class MetricData(object):
         --------
         >>> relidx = data.abs2rel(536)
         """
-        if not hasattr(absFrames, "__len__"):
-            absFrames = [absFrames]
-        endFrames = np.append(0, np.cumsum(self.trajLengths))
+        absFrames = np.atleast_1d(np.asarray(absFrames, dtype=int))
+        endFrames = np.cumsum(self.trajLengths)
+        if len(absFrames) and (absFrames.min() < 0 or absFrames.max() >= self.numFrames):
+            raise IndexError('Absolute frame indexes must be >= 0 and < {}'.format(self.numFrames))
 
+        trajIdx = np.searchsorted(endFrames, absFrames, side='right')
         relframe = np.zeros((len(absFrames), 2), dtype=int)
-        for i in range(len(absFrames)):
-            trajIdx = np.where(absFrames[i] < endFrames)[0][0] - 1
-            trajFr = absFrames[i] - endFrames[trajIdx]
-            relframe[i, :] = [trajIdx, trajFr]
+        relframe[:, 0] = trajIdx
+        relframe[:, 1] = absFrames - (endFrames - self.trajLengths)[trajIdx]
         return relframe
 
+    def frameTable(self, relFrames):
+        """ Converts trajectory index-frame pairs into a table of simulation index, trajectory piece and frame
+
+        A vectorized alternative to :meth:`rel2sim` which avoids creating a Frame object per row. The table can be
+        grouped by trajectory file with :func:`groupFrameTable`.
+
+        Parameters
+        ----------
+        relFrames : 2D np.ndarray
+            An array containing in each row trajectory index and frame pairs
+
+        Returns
+        -------
+        table : np.ndarray
+            A structured array with fields 'sim' (index into `simlist`), 'piece' and 'frame'
+
+        Examples
+        --------
+        >>> table = data.frameTable(data.abs2rel(range(1000)))
+        >>> table['piece']
+        """
+        relFrames = np.array(relFrames, dtype=int)
+        if relFrames.ndim == 1:
+            relFrames = relFrames[np.newaxis, :]
+
+        starts = np.append(0, np.cumsum(self.trajLengths))[:-1]
+        ref = self._contiguous('reference')[starts[relFrames[:, 0]] + relFrames[:, 1]]
+
+        table = np.zeros(len(relFrames), dtype=_FRAMETABLE_DTYPE)
+        table['sim'] = relFrames[:, 0]
+        table['piece'] = ref[:, 0]
+        table['frame'] = ref[:, 1]
+        return table
+
     def rel2sim(self, relFrames, simlist=None):
         """ Converts trajectory index-frame pairs into Sim-frame pairs
 
@@ -633,15 +1002,10 @@ class MetricData(object):
             if len(simlist) != len(self.simlist):
                 raise AttributeError('Provided simlist has different number of trajectories than the one used by this object.')
 
-        relFrames = np.array(relFrames)
-        if relFrames.ndim == 1:
-            relFrames = relFrames[np.newaxis, :]
-
-        frames = []
-        for trajID, trajFrame in relFrames:
-            ref = self.trajectories[trajID].reference
-            frames.append(Frame(simlist[trajID], ref[trajFrame, 0], ref[trajFrame, 1]))
-        return np.array(frames)
+        table = self.frameTable(relFrames)
+        frames = np.empty(len(table), dtype=object)
+        frames[:] = [Frame(simlist[s], p, f) for s, p, f in table.tolist()]
+        return frames
 
     def abs2sim(self, absFrames):
         """ Converts absolute frame indexes into Sim-frame pairs
@@ -678,44 +1042,104 @@ class MetricData(object):
         """
         return deepcopy(self)
 
-    def save(self, filename):
+    def save(self, filename, format='pickle'):
         """ Save a :class:`MetricData` object to disk
 
         Parameters
         ----------
         filename : str
             Path of the file in which to save the object
+        format : str
+            'pickle' saves the object in a single file. 'directory' creates a directory at `filename` containing one
+            contiguous .npy file for the projections, references and cluster assignments of all trajectories, an
+            offsets table of the trajectories and a small metadata file. Directories can be loaded memory-mapped.
 
         Examples
         --------
         >>> data = MetricSelfDistance.project(sims, 'protein and name CA')
         >>> data.save('./data.dat')
+        >>> data.save('./datadir', format='directory')
         """
+        if format == 'directory':
+            self._saveDirectory(filename)
+            return
+        elif format != 'pickle':
+            raise AttributeError('Invalid save format {}. Use "pickle" or "directory".'.format(format))
+
         #np.save(filename, [self.__dict__[k] for k in self.__dict__])
         parentpointer = self.parent
         if self.parent is not None:
-            self.parent = self.parent.__dict__
+            self.parent = self.parent.__getstate__()
 
         f = open(filename, 'wb')
-        pickle.dump(self.__dict__, f)
+        pickle.dump(self.__getstate__(), f)
         f.close()
 
         if self.parent is not None:
             self.parent = parentpointer
 
-    def load(self, filename):
+    def _saveDirectory(self, dirname):
+        import os
+        for t in self.trajectories:
+            if isinstance(t._projection, _LazyProjection) and \
+                    os.path.abspath(os.path.dirname(t._projection.store.filename)) == os.path.abspath(dirname):
+                raise RuntimeError('Cannot overwrite the directory {} from which the data is lazily loaded.'.format(dirname))
+        os.makedirs(dirname, exist_ok=True)
+
+        lengths = np.array([_getsizes(t._projection) or 0 for t in self.trajectories], dtype=np.int64)
+        offsets = np.append(0, np.cumsum(lengths))
+        np.save(os.path.join(dirname, 'offsets.npy'), offsets)
+        for field in ('projection', 'reference', 'cluster'):
+            fname = os.path.join(dirname, '{}.npy'.format(field))
+            # The stored values, so that lazily loaded projections are only read when they are written
+            values = [getattr(t, '_' + field) for t in self.trajectories]
+            if len(values) == 0 or np.any([v is None for v in values]):
+                if os.path.exists(fname):
+                    os.remove(fname)
+                continue
+            # Write trajectories one at a time to avoid concatenating them in memory
+            out = np.lib.format.open_memmap(fname, mode='w+', dtype=values[0].dtype,
+                                            shape=(int(offsets[-1]),) + np.shape(values[0])[1:])
+            for i, v in enumerate(values):
+                out[offsets[i]:offsets[i + 1]] = v.resolve() if isinstance(v, _LazyProjection) else v
+            out.flush()
+            del out
+
+        metadata = {k: v for k, v in self.__dict__.items() if k not in ('trajectories', 'parent') + _TRANSIENT}
+        metadata['simlist'] = [t.sim for t in self.trajectories]
+        metadata['hasparent'] = self.parent is not None
+        with open(os.path.join(dirname, 'metadata.pkl'), 'wb') as f:
+            pickle.dump(metadata, f)
+
+        if self.parent is not None:
+            self.parent._saveDirectory(os.path.join(dirname, 'parent'))
+
+    def load(self, filename, mmap=False, lazy=False, cachesize=100):
         """ Load a :class:`MetricData` object from disk
 
         Parameters
         ----------
         filename : str
             Path to the saved MetricData object
+        mmap : bool
+            For objects saved with format='directory'. If True, the arrays are memory-mapped read-only instead of
+            being read into memory, which makes loading immediate and only reads the data that is accessed.
+        lazy : bool
+            For objects saved with format='directory'. If True, the projection of each trajectory is read from disk
+            only when accessed and only the `cachesize` most recently used trajectories are kept in memory. Clustering
+            with `batchsize`, TICA and state statistics then work one chunk of trajectories at a time, allowing the
+            analysis of datasets which do not fit in memory. Note that `dat` will still read all projections.
+        cachesize : int
+            Number of trajectories kept in memory when `lazy` is True.
 
         Examples
         --------
         >>> data = MetricData()
         >>> data.load('./data.dat')
+        >>> data.load('./datadir', mmap=True)
+        >>> data.load('./datadir', lazy=True)
         """
+        import os
         import sys
         try:
             import pandas.indexes
@@ -723,6 +1147,10 @@ class MetricData(object):
             import pandas.core.indexes
             sys.modules['pandas.indexes'] = pandas.core.indexes  # Hacky fix for new pandas version
 
+        if isinstance(filename, str) and os.path.isdir(filename):
+            self._loadDirectory(filename, mmap, lazy, cachesize)
+            return
+
         # Patch for old HTMD versions
         if type(filename).__name__ == 'MetricData':
             filename = filename.__dict__
@@ -739,7 +1167,7 @@ class MetricData(object):
                 self.description = vardict['map']
             elif k == 'trajectories' and 'dat' in vardict:  # Patch for loading old data
                 self._loadTrajectories(vardict['dat'], vardict['ref'], vardict['simlist'], vardict['St'])
-            elif k != 'parent':
+            elif k != 'parent' and k not in _TRANSIENT:
                 try:
                     self.__dict__[k] = vardict[k]
                 except:
@@ -749,6 +1177,55 @@ class MetricData(object):
             self.parent = MetricData()
             self.parent.load(vardict['parent'])
 
+    def _loadDirectory(self, dirname, mmap=False, lazy=False, cachesize=100):
+        import os
+        with open(os.path.join(dirname, 'metadata.pkl'), 'rb') as f:
+            metadata = pickle.load(f)
+
+        offsets = np.load(os.path.join(dirname, 'offsets.npy'))
+        fields = {}
+        for field in ('projection', 'reference', 'cluster'):
+            fname = os.path.join(dirname, '{}.npy'.format(field))
+            if not os.path.exists(fname):
+                continue
+            if field == 'projection' and lazy:
+                store = _ProjectionStore(fname, offsets, cachesize)
+                fields[field] = [_LazyProjection(store, i) for i in range(len(offsets) - 1)]
+            else:
+                fields[field] = np.load(fname, mmap_mode='r' if mmap or lazy else None)
+
+        def trajfield(field):
+            if field not in fields:
+                return None
+            ret = np.empty(len(offsets) - 1, dtype=object)
+            if isinstance(fields[field], list):
+                ret[:] = fields[field]
+            else:
+                ret[:] = [fields[field][offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            return ret
+
+        simlist = np.empty(len(offsets) - 1, dtype=object)
+        simlist[:] = metadata.pop('simlist')
+        self._loadTrajectories(trajfield('projection'), trajfield('reference'), simlist, trajfield('cluster'))
+
+        for field, array in fields.items():
+            if not isinstance(array, list):
+                self._setContiguous(field, array)
+
+        hasparent = metadata.pop('hasparent')
+        for k in self.__dict__:
+            if k in ('trajectories', 'parent') + _TRANSIENT:
+                continue
+            if k in metadata:
+                self.__dict__[k] = metadata[k]
+            else:
+                logger.warning('Could not find class property {} in {}'.format(k, dirname))
+
+        self.parent = None
+        if hasparent:
+            self.parent = MetricData()
+            self.parent._loadDirectory(os.path.join(dirname, 'parent'), mmap, lazy, cachesize)
+
     def _defaultLags(self, minlag=None, maxlag=None, numlags=None, units='frames'):
         from htmd.units import convert as unitconvert
         if maxlag is None:
@@ -834,7 +1311,7 @@ class MetricData(object):
             Path of the file in which to save the figure
         """
         from matplotlib import pylab as plt
-        dc = np.concatenate(self.dat)
+        dc = np.concatenate([t.projection[:, [dimX, dimY]] for t in self.trajectories])
         if self.description is not None:
             xlabel = self.description.description[dimX]
         else:
@@ -845,7 +1322,7 @@ class MetricData(object):
             ylabel = 'Dimension {}'.format(dimY)
         title = 'Counts histogram'
 
-        f, ax, cf = self._contourPlot(dc[:, dimX], dc[:, dimY], resolution=resolution, xlabel=xlabel, ylabel=ylabel, title=title, logplot=logplot)
+        f, ax, cf = self._contourPlot(dc[:, 0], dc[:, 1], resolution=resolution, xlabel=xlabel, ylabel=ylabel, title=title, logplot=logplot)
         self._setColorbar(f, cf, 'Counts')
 
         if save is not None:
@@ -908,8 +1385,8 @@ class MetricData(object):
             ylabel = 'Dimension {}'.format(dimY)
 
         title = 'Clusters plotted onto counts histogram'
-        dc = np.concatenate(data.dat)
-        f, ax, cf = self._contourPlot(dc[:, dimX], dc[:, dimY], resolution=resolution, xlabel=xlabel, ylabel=ylabel, title=title, logplot=logplot)
+        dc = np.concatenate([t.projection[:, [dimX, dimY]] for t in data.trajectories])
+        f, ax, cf = self._contourPlot(dc[:, 0], dc[:, 1], resolution=resolution, xlabel=xlabel, ylabel=ylabel, title=title, logplot=logplot)
         y = ax.scatter(centers[:, dimX], centers[:, dimY], s=s, c=c, cmap=cmap, linewidths=0, marker='o')
         if c is not None:
             self._setColorbar(f, y, 'Cluster groups')
@@ -1003,8 +1480,7 @@ class MetricData(object):
         >>> abs, rel, mols = data.sampleRegion(limits=np.array([minlims, maxlims]))
         """
         from scipy.spatial.distance import cdist
-        datconcat = np.concatenate(self.dat)
-        numdim = datconcat.shape[1]
+        numdim = self.numDimensions
         if point is not None:
             if radius is None:
                 raise RuntimeError('You must define a radius with a point.')
@@ -1013,18 +1489,28 @@ class MetricData(object):
                 raise RuntimeError(
                     'Argument `point` should be same dimensionality as your data ({} dimensions)'.format(numdim))
             keepdim = np.array([p is not None for p in point])
-            dists = cdist(datconcat[:, keepdim], [point[keepdim]])
-            confs = np.where(dists < radius)[0]
         elif limits is not None:
             if limits.shape != (2, numdim):
                 raise RuntimeError('Argument `limits` should be of shape (2, {})'.format(numdim))
-            mask = np.ones(datconcat.shape[0], dtype=bool)
-            for i in range(numdim):
-                if limits[0, i] is not None:
-                    mask &= datconcat[:, i] > limits[0, i]
-                if limits[1, i] is not None:
-                    mask &= datconcat[:, i] < limits[1, i]
-            confs = np.where(mask)[0]
+
+        # Go through one trajectory at a time to avoid concatenating all data
+        confs = []
+        offset = 0
+        for t in self.trajectories:
+            dat = t.projection
+            if point is not None:
+                dists = cdist(dat[:, keepdim], [point[keepdim]])
+                confs.append(np.where(dists < radius)[0] + offset)
+            elif limits is not None:
+                mask = np.ones(dat.shape[0], dtype=bool)
+                for i in range(numdim):
+                    if limits[0, i] is not None:
+                        mask &= dat[:, i] > limits[0, i]
+                    if limits[1, i] is not None:
+                        mask &= dat[:, i] < limits[1, i]
+                confs.append(np.where(mask)[0] + offset)
+            offset += dat.shape[0]
+        confs = np.concatenate(confs)
 
         if len(confs) > nsamples:
             confs = np.random.choice(confs, nsamples, replace=False)
@@ -1043,9 +1529,38 @@ class MetricData(object):
         return confs, self.abs2rel(confs), mol
 
 
-def _sampleCluster(cluster, stConcat, numFrames, replacement):
-    frames = np.where(stConcat == cluster)[0]
-    return _randomSample(frames, numFrames, replacement)
+_TRANSIENT = ('_storage', '_clusterindex')
+_FRAMETABLE_DTYPE = np.dtype([('sim', np.int64), ('piece', np.int64), ('frame', np.int64)])
+
+
+def groupFrameTable(table):
+    """ Groups the rows of a frame table by trajectory file
+
+    Parameters
+    ----------
+    table : np.ndarray
+        A frame table as returned by :meth:`MetricData.frameTable`
+
+    Returns
+    -------
+    groups : list of tuples
+        One (sim index, piece, frames) tuple per trajectory file, where frames are the frame indexes to read from that
+        file in the order they appear in the table.
+
+    Examples
+    --------
+    >>> for simidx, piece, frames in groupFrameTable(data.frameTable(relframes)):
+    >>>     mol = Molecule(data.simlist[simidx].molfile)
+    >>>     mol.read(data.simlist[simidx].trajectory[piece], frames=frames)
+    """
+    if len(table) == 0:
+        return []
+    keys = np.stack((table['sim'], table['piece']), axis=1)
+    uqkeys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind='stable')
+    splits = np.split(table['frame'][order], np.cumsum(np.bincount(inverse))[:-1])
+    return [(int(k[0]), int(k[1]), fr) for k, fr in zip(uqkeys, splits)]
 
 
 def _randomSample(frames, numFr, replacement):
@@ -1083,10 +1598,9 @@ def _mergeSmallClusters(mergesmall, data, stconcat, centers, N, metric=None):
     frames = _ismember(stconcat, badcluidx)
     badframeidx = np.where(frames >= 0)[0]
 
-    # Calculate distance of all frames belonging to bad clusters to the good cluster centers
-    from scipy.spatial import distance
-    dists = distance.cdist(np.atleast_2d(data[badframeidx, :]), np.atleast_2d(centers), metric)
-    minidx = np.argmin(dists, axis=1)  # Find closest center. Indexes are relative to goodidx
+    # Find the closest good cluster center to all frames belonging to bad clusters
+    from htmd.clustering.kcenters import _assignCenters
+    _, minidx = _assignCenters(centers, data[badframeidx, :], p=_minkowskiNorm(data))  # Relative to goodidx
     newclu = goodcluidx[minidx]  # Back to absolute cluster indexes
 
     # Reassign bad frames to good clusters
@@ -1098,6 +1612,16 @@ def _mergeSmallClusters(mergesmall, data, stconcat, centers, N, metric=None):
     return K, stconcat, centers, N, badclusters
 
 
+def _predictChunk(clusterobj, data, start, chunksize):
+    return clusterobj.predict(np.asarray(data[start:start + chunksize], dtype=np.float32))
+
+
+def _minkowskiNorm(data):
+    """ The Minkowski norm used to find closest cluster centers. The L1 norm gives the same results as the hamming
+    distance on boolean data. """
+    return 1 if data.dtype == 'bool' else 2
+
+
 def _ismember(a, b):
     bind = {}
     for i, elt in enumerate(list(set(b))):
@@ -1180,6 +1704,118 @@ class _TestMetricData(unittest.TestCase):
         newdata = MetricData(file=savefile)
         checkCorrectness(newdata)
 
+    def test_saving_loading_directory(self):
+        from moleculekit.util import tempname
+
+        data1 = self.data1.copy()
+        data1.parent = self.data2.copy()
+        savedir = tempname()
+        data1.save(savedir, format='directory')
+
+        for mmap in (False, True):
+            newdata = MetricData()
+            newdata.load(savedir, mmap=mmap)
+            assert newdata.numTrajectories == 2, 'Failed to load trajectories'
+            assert newdata.description.shape == (9, 3), 'Failed to load pandas data'
+            assert newdata.fstep == data1.fstep
+            assert isinstance(newdata.trajectories[0].projection, np.memmap) == mmap
+            for t1, t2 in zip(data1.trajectories, newdata.trajectories):
+                assert np.array_equal(t1.projection, t2.projection)
+                assert np.array_equal(t1.reference, t2.reference)
+                assert t1.sim == t2.sim
+            assert newdata.parent.numTrajectories == 2
+            assert np.array_equal(newdata.parent.trajectories[1].projection, data1.parent.trajectories[1].projection)
+
+    def test_frame_translation(self):
+        data = self.data1
+        absframes = np.array([0, 5, 6, data.numFrames - 1])
+        rel = data.abs2rel(absframes)
+        endframes = np.append(0, np.cumsum(data.trajLengths))
+        for a, (traj, fr) in zip(absframes, rel):
+            assert endframes[traj] <= a < endframes[traj + 1] and a - endframes[traj] == fr
+
+        table = data.frameTable(rel)
+        frames = data.rel2sim(rel)
+        assert np.array_equal(table['sim'], rel[:, 0])
+        assert np.array_equal(table['piece'], [f.piece for f in frames])
+        assert np.array_equal(table['frame'], [f.frame for f in frames])
+
+        groups = groupFrameTable(table)
+        assert sum(len(g[2]) for g in groups) == len(table)
+        for simidx, piece, fr in groups:
+            sel = (table['sim'] == simidx) & (table['piece'] == piece)
+            assert np.array_equal(table['frame'][sel], fr)
+
+    def test_state_index(self):
+        labels = np.array([2, 0, -1, 2, 1, 0, 2])
+        index = _StateIndex(labels, 4)
+        for st in range(4):
+            assert np.array_equal(index.get(st), np.where(labels == st)[0])
+        assert np.array_equal(index.counts(), [2, 1, 3, 0])
+        assert len(index.get(5)) == 0
+
+    def test_incremental_clustering(self):
+        from htmd.clustering.kcenters import KCenter
+        olddata = self.data2.copy()
+        olddata.dropTraj(idx=[1])
+        olddata.cluster(KCenter(n_clusters=4))
+
+        data = self.data2.copy()
+        data.cluster(KCenter(n_clusters=4), incremental=olddata, maxgrowth=2, maxdrift=100)
+        assert np.array_equal(data.Centers, olddata.Centers)
+        assert np.array_equal(data.trajectories[0].cluster, olddata.trajectories[0].cluster)
+        assert np.array_equal(data.N, np.bincount(np.concatenate(data.St), minlength=data.K))
+
+        # Growth above the threshold triggers a new fit
+        data = self.data2.copy()
+        data.cluster(KCenter(n_clusters=3), incremental=olddata, maxgrowth=0)
+        assert data.K == 3
+
+    def test_subset_clustering(self):
+        from sklearn.cluster import MiniBatchKMeans
+        data = self.data2.copy()
+        data.cluster(MiniBatchKMeans(n_clusters=3, random_state=0), fitframes=5, njobs=2)
+        assert np.sum(data.N) == data.numFrames
+        assert np.array_equal(data.trajLengths, [len(t.cluster) for t in data.trajectories])
+
+        data.cluster(MiniBatchKMeans(n_clusters=3, random_state=0), fitstride=2, njobs=1)
+        assert np.sum(data.N) == data.numFrames
+
+    def test_contiguous_storage(self):
+        data = self.data2.copy()
+        datconcat = data._contiguous('projection')
+        assert np.array_equal(datconcat, np.concatenate(data.dat))
+        assert data._contiguous('projection') is datconcat, 'Contiguous storage was rebuilt without modifications'
+        assert np.shares_memory(datconcat, data.trajectories[1].projection)
+
+        data.trajectories[1].projection = data.trajectories[1].projection * 2
+        datconcat2 = data._contiguous('projection')
+        assert datconcat2 is not datconcat
+        assert np.array_equal(datconcat2, np.concatenate(data.dat))
+
+    def test_lazy_loading(self):
+        from moleculekit.util import tempname
+        from sklearn.cluster import MiniBatchKMeans
+        from htmd.model import getStateStatistic
+
+        savedir = tempname()
+        self.data2.save(savedir, format='directory')
+        lazydata = MetricData()
+        lazydata.load(savedir, lazy=True, cachesize=1)
+        assert lazydata._isLazy()
+        assert np.array_equal(lazydata.trajLengths, self.data2.trajLengths)
+        for t1, t2 in zip(self.data2.trajectories, lazydata.trajectories):
+            assert np.array_equal(t1.projection, t2.projection)
+        assert len(lazydata.trajectories[0]._projection.store._resident) == 1
+
+        lazydata.cluster(MiniBatchKMeans(n_clusters=3, random_state=0), batchsize=5)
+        assert np.sum(lazydata.N) == lazydata.numFrames
+        data = self.data2.copy()
+        for t1, t2 in zip(data.trajectories, lazydata.trajectories):
+            t1.cluster = t2.cluster
+        stat = getStateStatistic(data, data, range(lazydata.K), statetype='cluster')
+        lazystat = getStateStatistic(lazydata, lazydata, range(lazydata.K), statetype='cluster')
+        assert np.allclose(np.vstack(stat), np.vstack(lazystat))
 
 
 if __name__ == '__main__':
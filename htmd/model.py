@@ -13,6 +13,7 @@ References
 # No redistribution in whole or part
 #
 import numpy as np
+from numba import njit, prange
 from scipy import stats
 import warnings
 import random
@@ -23,6 +24,61 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class ImpliedTimescales(object):
+    """ Implied timescales of the MSMs of a clustered dataset at several lag times
+
+    Created by :meth:`Model.impliedTimescales`. The timescales are stored in frames and converted to other units
+    only for plotting.
+
+    Attributes
+    ----------
+    lags : np.ndarray
+        The lag times in frames
+    timescales : np.ndarray
+        The implied timescales in frames. 2D array with dimensions (len(`lags`), nits). Missing timescales are NaN.
+    errors : np.ndarray
+        The standard deviation of the timescales over bootstrap samples or None
+    fstep : float
+        The frame step of the data in nanoseconds
+    """
+
+    def __init__(self, lags, timescales, fstep, errors=None):
+        self.lags = np.asarray(lags)
+        self.timescales = np.asarray(timescales)
+        self.errors = errors
+        self.fstep = fstep
+
+    def get(self, lag):
+        """ The implied timescales of the MSM at lag time `lag` in frames """
+        idx = np.flatnonzero(self.lags == lag)
+        if len(idx) == 0:
+            raise ValueError('Lag time {} was not calculated'.format(lag))
+        return self.timescales[idx[0]]
+
+    def plot(self, units='ns'):
+        """ Plots the implied timescales in the current figure
+
+        Parameters
+        ----------
+        units : str
+            The time units of the axes. Can be 'frames' or any time unit given as a string.
+        """
+        from matplotlib import pylab as plt
+        dt = 1 if units == 'frames' else unitconvert('frames', units, 1, fstep=self.fstep)
+        lags = self.lags * dt
+        ax = plt.gca()
+        for i in range(self.timescales.shape[1]):
+            line = ax.semilogy(lags, self.timescales[:, i] * dt, marker='o', markersize=3)[0]
+            if self.errors is not None:
+                ax.fill_between(lags, (self.timescales[:, i] - self.errors[:, i]) * dt,
+                                (self.timescales[:, i] + self.errors[:, i]) * dt, alpha=0.2, color=line.get_color())
+        ax.plot(lags, lags, linewidth=2, color='black')
+        ax.fill_between(lags, np.full(len(lags), ax.get_ylim()[0]), lags, alpha=0.5, color='grey')
+        ax.set_xlabel('lag time / {}'.format(units))
+        ax.set_ylabel('timescale / {}'.format(units))
+        return ax
+
+
 class Model(object):
     """ Constructor for the Model class.
 
@@ -58,7 +114,7 @@ class Model(object):
             raise NameError('You have modified the data in data.dat after clustering. Please re-cluster.')
         self._clusterid = self.data._clusterid
 
-    def markovModel(self, lag, macronum, units='frames', sparse=False, hmm=False):
+    def markovModel(self, lag, macronum, units='frames', sparse=False, hmm=False, backend='pyemma'):
         """ Build a Markov model at a given lag time and calculate metastable states
 
         Parameters
@@ -71,19 +127,32 @@ class Model(object):
             The units of lag. Can be 'frames' or any time unit given as a string.
         sparse : bool
             Make the transition matrix sparse. Useful if lots (> 4000) states are used for the MSM. Warning: untested.
+        backend : ('pyemma', 'native'), str
+            The native backend estimates the reversible MSM from the cached sparse count matrices of the model with a
+            parallel fixed-point iteration and calculates the eigenvectors with scipy.sparse.linalg. Its macrostates
+            are calculated with PCCA+ as in pyemma.
+            HMMs and the Chapman-Kolmogorov test require the pyemma backend. The pyemma backend counts the transitions
+            of the discretized trajectories itself and does not use the cached count matrices.
 
         Examples
         --------
         >>> model = Model(data)
         >>> model.markovModel(150, 4)  # 150 frames lag, 4 macrostates
         """
-        import pyemma.msm as msm
+        if backend not in ('pyemma', 'native'):
+            raise ValueError('backend must be either \'pyemma\' or \'native\'')
+        if hmm and backend != 'pyemma':
+            raise ValueError('HMMs can only be built with the pyemma backend')
         self._integrityCheck(markov=True)
 
         lag = unitconvert(units, 'frames', lag, fstep=self.data.fstep)
 
         self.lag = lag
-        self.msm = msm.estimate_markov_model(self.data.St.tolist(), self.lag, sparse=sparse)
+        if backend == 'native':
+            self.msm = _NativeMSM(self._countMatrices([self.lag])[0], self.lag, sparse=sparse)
+        else:
+            import pyemma.msm as msm
+            self.msm = msm.estimate_markov_model(self.data.St.tolist(), self.lag, sparse=sparse)
         modelflag = False
         while not modelflag:
             self.coarsemsm = self.msm.pcca(macronum)
@@ -120,6 +189,9 @@ class Model(object):
         """
         if microstates is not None and indexpairs is not None:
             raise AttributeError('microstates and indexpairs arguments are mutually exclusive')
+        self._stateindex = {}
+        self._countcache = None
+        self._itscache = None
         if microstates is not None:
             newmacro = self.macronum
 
@@ -151,8 +223,55 @@ class Model(object):
             newcluster = self.data.K
             for ip in indexpairs:
                 self.data.trajectories[ip[0]].cluster[ip[1]] = newcluster
+            self.data._clusterindex = None
             self.data.K += 1
-            self.data.N = np.bincount(np.concatenate(self.data.St))
+            self.data.N = np.bincount(self.data._contiguous('cluster'))
+
+    def _stateIndex(self, statetype):
+        """ A :class:`_StateIndex <htmd.metricdata._StateIndex>` of the frames of each micro or macrostate, rebuilt
+        only when the model or the clustering change """
+        from htmd.metricdata import _StateIndex
+        key = (self._modelid, self.data._clusterid)
+        cache = self.__dict__.setdefault('_stateindex', {})
+        if statetype not in cache or cache[statetype][0] != key:
+            if statetype == 'macro':
+                index = _StateIndex(self.macro_ofcluster[self.data._contiguous('cluster')], self.macronum)
+            elif statetype == 'micro':
+                index = _StateIndex(self.micro_ofcluster[self.data._contiguous('cluster')], self.micronum)
+            elif statetype == 'cluster':
+                index = self.data._clusterIndex()
+            else:
+                raise NameError('No valid state type given (read documentation)')
+            cache[statetype] = (key, index)
+        return cache[statetype][1]
+
+    def _trajectoryCountMatrices(self, lag):
+        """ Count matrices of each trajectory at lag time `lag` in frames (see :func:`_trajectoryCountMatrices`),
+        cached together with the count matrices of the model """
+        self._countMatrices([])
+        cache = self._countcache[1]
+        if ('trajectories', lag) not in cache:
+            cache[('trajectories', lag)] = _trajectoryCountMatrices(self.data._contiguous('cluster'),
+                                                                    np.cumsum(self.data.trajLengths), lag, self.data.K)
+        return cache[('trajectories', lag)]
+
+    def _countMatrices(self, lags):
+        """ Sliding-window transition count matrices of the clusters at the given lag times in frames
+
+        The lag times which were not counted before for the current clustering are counted together in a single pass
+        over the discretized trajectories.
+        """
+        key = (self.data._clusterid, self.data.K)
+        cache = self.__dict__.get('_countcache')
+        if cache is None or cache[0] != key:
+            cache = (key, {})
+            self._countcache = cache
+        lags = [int(l) for l in np.atleast_1d(lags)]
+        missing = sorted(set(l for l in lags if l not in cache[1]))
+        if len(missing):
+            cache[1].update(zip(missing, _countMatrices(self.data._contiguous('cluster'),
+                                                        np.cumsum(self.data.trajLengths), missing, self.data.K)))
+        return [cache[1][l] for l in lags]
 
     @property
     def P(self):
@@ -217,7 +336,7 @@ class Model(object):
         return macro_ofcluster
 
     def plotTimescales(self, lags=None, minlag=None, maxlag=None, numlags=25, units='frames', errors=None, nits=None,
-                       results=False, plot=True, save=None, njobs=-2):
+                       results=False, plot=True, save=None, njobs=-2, backend='pyemma'):
         """ Plot the implied timescales of MSMs of various lag times
 
         Parameters
@@ -233,7 +352,9 @@ class Model(object):
         units : str
             The units of lag. Can be 'frames' or any time unit given as a string.
         errors : errors
-            Calculate errors using Bayes (Refer to pyEMMA documentation)
+            With the pyemma backend, calculate errors using Bayes (Refer to pyEMMA documentation). With the native
+            backend, the number of bootstrap samples over the trajectories used to estimate the errors (see
+            :meth:`impliedTimescales`).
         nits : int
             Number of implied timescales to calculate. Default: all
         results : bool
@@ -245,6 +366,9 @@ class Model(object):
         njobs : int
             Number of parallel jobs to spawn for calculation of timescales. Negative numbers are used for spawning jobs as many as CPU threads. 
             -1: for all CPUs -2: for all except one etc.
+        backend : ('pyemma', 'native'), str
+            The pyemma backend calculates the timescales with pyemma. The native backend estimates them from the cached
+            count matrices of the model with :meth:`impliedTimescales`.
 
         Returns
         -------
@@ -261,8 +385,6 @@ class Model(object):
         >>> model.plotTimescales(lags=list(range(1,100,5)))
         >>> model.plotTimescales(minlag=0.1, maxlag=20, numlags=25, units='ns')
         """
-        import pyemma.plots as mplt
-        import pyemma.msm as msm
         self._integrityCheck()
         if lags is None:
             lags = self.data._defaultLags(minlag, maxlag, numlags, units)
@@ -272,14 +394,29 @@ class Model(object):
         if nits is None:
             nits = np.min((self.data.K, 20))
 
-        from htmd.config import _config
-        its = msm.its(self.data.St.tolist(), lags=lags, errors=errors, nits=nits, n_jobs=njobs) # Use all CPUs minus one
+        if backend == 'native':
+            import numbers
+            if errors is not None and (isinstance(errors, bool) or not isinstance(errors, numbers.Integral)):
+                raise ValueError('The native backend estimates errors by bootstrapping. errors must be the number of '
+                                 'bootstrap samples.')
+            its = self.impliedTimescales(lags, nits=nits, errors=errors, njobs=njobs)
+            timescales, lags = its.timescales, its.lags
+        elif backend == 'pyemma':
+            import pyemma.msm as msm
+            its = msm.its(self.data.St.tolist(), lags=lags, errors=errors, nits=nits, n_jobs=njobs) # Use all CPUs minus one
+            timescales, lags = its.get_timescales(), its.lags
+        else:
+            raise ValueError('backend must be either \'pyemma\' or \'native\'')
         if plot or (save is not None):
             from matplotlib import pylab as plt
             plt.ion()
             plt.figure()
             try:
-                mplt.plot_implied_timescales(its, dt=self.data.fstep, units='ns')
+                if backend == 'native':
+                    its.plot(units='ns')
+                else:
+                    import pyemma.plots as mplt
+                    mplt.plot_implied_timescales(its, dt=self.data.fstep, units='ns')
             except ValueError as ve:
                 plt.close()
                 raise ValueError('{} This is probably caused by badly set fstep in the data ({}). '.format(ve, self.data.fstep) +
@@ -289,9 +426,99 @@ class Model(object):
             if plot:
                 plt.show()
         if results:
-            return its.get_timescales(), its.lags
+            return timescales, lags
+
+    def impliedTimescales(self, lags=None, minlag=None, maxlag=None, numlags=25, units='frames', nits=None, errors=None,
+                          seed=None, njobs=None):
+        """ Calculates the implied timescales of MSMs of various lag times
+
+        The reversible MSMs of the largest connected set are estimated in parallel from the cached count matrices of the
+        model. The timescales and their errors are cached until the data is reclustered, so only lag times which were
+        not calculated before are estimated.
+
+        Parameters
+        ----------
+        lags : list
+            Specify explicitly at which lag times to compute the timescales.
+        minlag: float
+            The minimum lag time for the timescales. Used in combination with `maxlag` and `numlags`.
+        maxlag: float
+            The maximum lag time for the timescales. If None will default to the mode length of the trajectories.
+        numlags: int
+            The number of points to place between `minlag` and `maxlag`.
+        units : str
+            The units of lag. Can be 'frames' or any time unit given as a string.
+        nits : int
+            Number of implied timescales to calculate. Default: all up to 20
+        errors : int
+            Number of bootstrap samples over the trajectories used to estimate the standard deviation of the timescales.
+            Each sample draws trajectories with replacement and sums their count matrices. If None no errors are
+            calculated.
+        seed : int
+            Seed of the random trajectory sampling of the errors
+        njobs : int
+            Number of parallel jobs to spawn for estimating the MSMs. If None it will use the default from htmd.config.
 
-    def maxConnectedLag(self, lags):
+        Returns
+        -------
+        its : :class:`ImpliedTimescales` object
+            The implied timescales of all lag times
+
+        Examples
+        --------
+        >>> its = model.impliedTimescales(lags=list(range(1, 100, 5)))
+        >>> its.timescales[:, 0]
+        >>> its = model.impliedTimescales(lags=list(range(1, 100, 5)), errors=100)
+        >>> its.plot(units='ns')
+        """
+        from htmd.parallelprogress import ParallelExecutor, delayed
+        from htmd.util import _getNjobs
+        if lags is None:
+            lags = self.data._defaultLags(minlag, maxlag, numlags, units)
+        elif units != 'frames':
+            lags = unitconvert(units, 'frames', lags, fstep=self.data.fstep)
+        lags = [int(l) for l in np.atleast_1d(lags)]
+        if nits is None:
+            nits = np.min((self.data.K, 20))
+        nits = int(nits)
+        njobs = njobs if njobs is not None else _getNjobs()
+
+        key = (self.data._clusterid, self.data.K)
+        cache = self.__dict__.get('_itscache')
+        if cache is None or cache[0] != key:
+            cache = (key, {})
+            self._itscache = cache
+        missing = sorted(set(l for l in lags if l not in cache[1] or len(cache[1][l]) < nits))
+        if len(missing) == 1 or njobs == 1:
+            results = [_impliedTimescales(C, lag, nits) for C, lag in zip(self._countMatrices(missing), missing)]
+        elif len(missing):
+            aprun = ParallelExecutor(n_jobs=njobs, cost=missing)
+            results = aprun(total=len(missing), desc='Estimating timescales')(
+                delayed(_impliedTimescales)(C, lag, nits) for C, lag in zip(self._countMatrices(missing), missing))
+        if len(missing):
+            cache[1].update(zip(missing, results))
+        timescales = np.vstack([cache[1][l][:nits] for l in lags]) if len(lags) else np.zeros((0, nits))
+        if errors is None:
+            return ImpliedTimescales(lags, timescales, self.data.fstep)
+
+        # Errors are cached by lag time together with the number of samples they were estimated from
+        missing = sorted(set(l for l in lags if ('errors', l) not in cache[1] or cache[1][('errors', l)][0] != errors
+                             or len(cache[1][('errors', l)][1]) < nits))
+        if len(missing):
+            rng = np.random.RandomState(seed)
+            numtraj = self.data.numTrajectories
+            weights = np.vstack([np.bincount(rng.randint(numtraj, size=numtraj), minlength=numtraj)
+                                 for _ in range(errors)])
+            aprun = ParallelExecutor(n_jobs=njobs, cost=missing)
+            results = aprun(total=len(missing), desc='Bootstrapping timescales')(
+                delayed(_bootstrapTimescales)(self._trajectoryCountMatrices(lag), weights, self.data.K, lag, nits)
+                for lag in missing)
+            for lag, ts in zip(missing, results):
+                cache[1][('errors', lag)] = (errors, np.nanstd(ts, axis=0))
+        errs = np.vstack([cache[1][('errors', l)][1][:nits] for l in lags]) if len(lags) else np.zeros((0, nits))
+        return ImpliedTimescales(lags, timescales, self.data.fstep, errors=errs)
+
+    def maxConnectedLag(self, lags, backend='pyemma'):
         """ Heuristic for getting the lagtime before a timescale drops.
 
         It calculates the last lagtime before a drop occurs in the first implied timescale due to disconnected states.
@@ -302,6 +529,8 @@ class Model(object):
         ----------
         lags : np.ndarray or list
             A list of lag times for which to calculate the implied timescales
+        backend : ('pyemma', 'native'), str
+            Calculate the implied timescales with pyemma or with :meth:`impliedTimescales`
 
         Returns
         -------
@@ -318,8 +547,13 @@ class Model(object):
         if isinstance(lags, np.ndarray):
             lags = lags.astype(int)
 
-        import pyemma.msm as msm
-        itime = msm.its(self.data.St.tolist(), lags=lags, nits=2).get_timescales()
+        if backend == 'native':
+            itime = self.impliedTimescales(lags, nits=2).timescales
+        elif backend == 'pyemma':
+            import pyemma.msm as msm
+            itime = msm.its(self.data.St.tolist(), lags=lags, nits=2).get_timescales()
+        else:
+            raise ValueError('backend must be either \'pyemma\' or \'native\'')
 
         for i in range(1, np.size(itime, 0)):
             if abs(itime[i, 0] - itime[i-1, 1]) < abs(itime[i, 0] - itime[i-1, 0]):
@@ -391,7 +625,7 @@ class Model(object):
         if frames is None or isinstance(frames, int):
             frames = np.repeat(frames, len(states))
 
-        stConcat = np.concatenate(self.data.St)
+        stConcat = self.data._contiguous('cluster')
         absFrames = []
         relFrames = []
         for i in range(len(states)):
@@ -695,12 +929,12 @@ class Model(object):
         tmpdata = self.data
         if self.data.parent is not None:
             tmpparentdata = self.data.parent
-            self.data.parent = self.data.parent.__dict__
-        self.data = self.data.__dict__
+            self.data.parent = self.data.parent.__getstate__()
+        self.data = self.data.__getstate__()
 
         # Dump the dict
         f = open(filename, 'wb')
-        pickle.dump(self.__dict__, f)
+        pickle.dump({k: v for k, v in self.__dict__.items() if k not in ('_stateindex', '_countcache', '_itscache')}, f)
         f.close()
 
         # Restore data to classes
@@ -766,6 +1000,8 @@ class Model(object):
         """
         from copy import deepcopy
         from pyemma.plots import plot_cktest
+        if isinstance(self.msm, _NativeMSM):
+            raise RuntimeError('The Chapman-Kolmogorov test requires a model built with the pyemma backend')
         msm = deepcopy(self.msm)
         ck = msm.cktest(self.macronum)
         plot_cktest(ck)
@@ -1027,22 +1263,19 @@ def getStateStatistic(reference, data, states, statetype='macro', weighted=False
 
     if refdata.numTrajectories > 0 and np.any(refdata.trajLengths != data.trajLengths):
         raise NameError('Data trajectories need to match in size and number to the trajectories in the model')
-    stconcat = np.concatenate(refdata.St)
-    datconcat = np.concatenate(data.dat)
+    if statetype not in ('macro', 'micro', 'cluster'):
+        raise NameError('No valid state type given (read documentation)')
+    if statetype == 'cluster':
+        index = refdata._clusterIndex()
+    else:
+        index = reference._stateIndex(statetype)
+    datconcat = data._concatenated()
 
     statistic = []
     for i, st in enumerate(states):
-        if statetype == 'macro':
-            frames = reference.macro_ofcluster[stconcat] == st
-        elif statetype == 'micro':
-            frames = reference.micro_ofcluster[stconcat] == st
-        elif statetype == 'cluster':
-            frames = stconcat == st
-        else:
-            raise NameError('No valid state type given (read documentation)')
-
+        frames = index.get(st)
         if statetype == 'macro' and weighted:
-            statistic.append(_weightedMethod(reference, method, stconcat, datconcat, st, axis))
+            statistic.append(_weightedMethod(reference, method, datconcat, st, axis))
         else:
             if axis is None:
                 statistic.append(method(datconcat[frames, ...]))
@@ -1051,13 +1284,13 @@ def getStateStatistic(reference, data, states, statetype='macro', weighted=False
     return statistic
 
 
-def _weightedMethod(model, method, stconcat, datconcat, st, axis):
+def _weightedMethod(model, method, datconcat, st, axis):
     microsofmacro = np.where(model.macro_ofmicro == st)[0]
     eq = model.msm.stationary_distribution
     weights = eq / np.sum(eq[microsofmacro])
     avgstatistic = np.zeros(np.size(datconcat, 1))
     for m in microsofmacro:
-        frames = model.micro_ofcluster[stconcat] == m
+        frames = model._stateIndex('micro').get(m)
         if axis is None:
             stat = method(datconcat[frames, :])
         else:
@@ -1082,16 +1315,14 @@ def macroAccumulate(model, microvalue):
         An array of values corresponding to the macrostates of the model
     """
     res = np.zeros(model.macronum)
-    for i in range(len(microvalue)):
-        macro = model.macro_ofmicro[i]
-        res[macro] = res[macro] + microvalue[i]
+    np.add.at(res, model.macro_ofmicro[:len(microvalue)], microvalue)
     return res
 
 
 def _sampleMacro(obj, macro, stConcat, mode, numFrames, replacement):
     from htmd.metricdata import _randomSample
     if mode == 'random':
-        frames = np.where(obj.macro_ofcluster[stConcat] == macro)[0]
+        frames = obj._stateIndex('macro').get(macro)
         selFrames = _randomSample(frames, numFrames, replacement)
         selMicro = obj.micro_ofcluster[stConcat[selFrames]]
     elif mode == 'even':
@@ -1133,7 +1364,7 @@ def _sampleMacro(obj, macro, stConcat, mode, numFrames, replacement):
 
 def _sampleMicro(obj, micro, stConcat, numFrames, replacement):
     from htmd.metricdata import _randomSample
-    frames = np.where(obj.micro_ofcluster[stConcat] == micro)[0]
+    frames = obj._stateIndex('micro').get(micro)
     return _randomSample(frames, numFrames, replacement)
 
 
@@ -1176,6 +1407,305 @@ def _macroTrajSt(St, macro_ofcluster):
     return mst
 
 
+class _NativeMSM(object):
+    """ Reversible maximum likelihood MSM of the largest connected set of a sparse count matrix
+
+    Provides the attributes of the pyemma MSM which are used by :class:`Model` and :class:`Kinetics
+    <htmd.kinetics.Kinetics>`. The metastable states are calculated with PCCA+ as in pyemma.
+    """
+    def __init__(self, C, lag, sparse=False):
+        from scipy.sparse import csr_matrix
+        self.lag = lag
+        self.active_set = _largestConnectedSet(C)
+        self.count_matrix_active = C[self.active_set][:, self.active_set]
+        self.active_count_fraction = self.count_matrix_active.sum() / C.sum()
+        self._X, self._x = _reversibleMLE(self.count_matrix_active)
+        self.stationary_distribution = self._x / self._x.sum()
+        T = csr_matrix(self._X.multiply(1 / self._x[:, None]))
+        self.transition_matrix = T if sparse else T.toarray()
+        self.metastable_sets = None
+        self.metastable_assignments = None
+        self._metastable_memberships = None
+        self._metastable_distributions = None
+
+    @property
+    def nstates(self):
+        return len(self.active_set)
+
+    @property
+    def metastable_memberships(self):
+        return self._metastable_memberships
+
+    @property
+    def metastable_distributions(self):
+        return self._metastable_distributions
+
+    def eigenvectors_right(self, k):
+        """ The right eigenvectors of the `k` largest eigenvalues of the transition matrix """
+        # The eigenvectors u of the symmetric matrix X_ij / sqrt(x_i x_j) give the right eigenvectors u / sqrt(pi)
+        d = 1 / np.sqrt(self._x)
+        S = self._X.multiply(d[:, None]).multiply(d[None, :]).tocsr()
+        if self.nstates <= 1000 or k >= self.nstates - 1:
+            from scipy.linalg import eigh
+            evals, evecs = eigh(S.toarray())
+        else:
+            from scipy.sparse.linalg import eigsh
+            evals, evecs = eigsh(S, k=k, which='LA')
+        order = np.argsort(evals)[::-1][:k]
+        return evecs[:, order] / np.sqrt(self.stationary_distribution)[:, None]
+
+    def pcca(self, m):
+        """ Calculates `m` metastable states with PCCA+, optimizing the memberships like pyemma """
+        if m > self.nstates:
+            raise ValueError('Cannot calculate {} metastable states from an MSM of {} states'.format(m, self.nstates))
+        right = self.eigenvectors_right(m)
+        right[:, 0] = np.abs(right[:, 0])
+        # Inner simplex algorithm: the vertices are the states which span the largest simplex in the eigenvector space
+        vertices = np.zeros(m, dtype=int)
+        vertices[0] = np.argmax(np.linalg.norm(right, axis=1))
+        ortho = right - right[vertices[0]]
+        for j in range(1, m):
+            norms = np.linalg.norm(ortho, axis=1)
+            norms[vertices[:j]] = -1
+            vertices[j] = np.argmax(norms)
+            v = ortho[vertices[j]] / norms[vertices[j]]
+            ortho = ortho - np.outer(ortho.dot(v), v)
+        rotation = _optimizeRotation(right, np.linalg.inv(right[vertices]))
+        chi = np.clip(right.dot(rotation), 0, 1)
+        chi /= chi.sum(axis=1)[:, None]
+
+        self._metastable_memberships = chi
+        distributions = chi.T * self.stationary_distribution
+        self._metastable_distributions = distributions / distributions.sum(axis=1)[:, None]
+        self.metastable_assignments = np.argmax(chi, axis=1)
+        self.metastable_sets = [np.where(self.metastable_assignments == i)[0] for i in range(m)]
+        return self
+
+
+def _fillRotation(crop, right):
+    """ The PCCA+ rotation matrix given all but its first row and column, which are chosen to keep the memberships
+    normalized and non-negative (Roeblitz and Weber, Adv Data Anal Classif 7, 147 (2013)) """
+    crop = np.hstack((-crop.sum(axis=1)[:, None], crop))
+    first = np.max(-right[:, 1:].dot(crop), axis=0)
+    return np.vstack((first, crop)) / first.sum()
+
+
+def _optimizeRotation(right, rotation):
+    """ Optimizes the PCCA+ rotation matrix of the inner simplex algorithm by maximizing the crispness of the
+    memberships right.dot(rotation) with the Nelder-Mead simplex method as done by pyemma """
+    from scipy.optimize import fmin
+    m = rotation.shape[0]
+    if m == 1:
+        return rotation
+
+    def objective(alpha):
+        rot = _fillRotation(alpha.reshape(m - 1, m - 1), right)
+        return -np.sum(rot ** 2 / rot[0])
+
+    alpha = fmin(objective, rotation[1:, 1:].flatten(), disp=False)
+    return _fillRotation(alpha.reshape(m - 1, m - 1), right)
+
+
+@njit(parallel=True, cache=True)
+def _lagKeys(labels, ends, lags, start, stop, numstates, keys):
+    # Encodes the transition of each frame in [start, stop) at each lag time as from * numstates + to, or -1 if the
+    # lagged frame is in another trajectory
+    for l in prange(len(lags)):
+        t = np.searchsorted(ends, start, side='right')
+        for i in range(start, stop):
+            while i >= ends[t]:
+                t += 1
+            j = i + lags[l]
+            if j < ends[t] and labels[i] >= 0 and labels[j] >= 0:
+                keys[l, i - start] = labels[i] * numstates + labels[j]
+            else:
+                keys[l, i - start] = -1
+
+
+def _countMatrices(labels, ends, lags, numstates, chunksize=1000000):
+    """ Sliding-window count matrices of the concatenated discrete trajectories `labels` ending at `ends` for all lags
+
+    Returns a list of scipy.sparse.csr_matrix, one per lag time.
+    """
+    from scipy.sparse import csr_matrix
+    labels = np.ascontiguousarray(labels, dtype=np.int64)
+    ends = np.ascontiguousarray(ends, dtype=np.int64)
+    lags = np.array(lags, dtype=np.int64)
+    dense = numstates * numstates <= 2 ** 22  # Small enough to count with a dense bincount
+    counts = [csr_matrix((numstates, numstates), dtype=np.int64) for _ in lags]
+    keys = np.empty((len(lags), min(chunksize, len(labels))), dtype=np.int64)
+    for start in range(0, len(labels), chunksize):
+        stop = min(start + chunksize, len(labels))
+        _lagKeys(labels, ends, lags, start, stop, numstates, keys)
+        for l in range(len(lags)):
+            k = keys[l, :stop - start]
+            k = k[k >= 0]
+            if dense:
+                n = np.bincount(k, minlength=numstates * numstates)
+                k = np.flatnonzero(n)
+                n = n[k]
+            else:
+                k, n = np.unique(k, return_counts=True)
+            counts[l] = counts[l] + csr_matrix((n, (k // numstates, k % numstates)), shape=(numstates, numstates))
+    return counts
+
+
+def _largestConnectedSet(C):
+    """ The states of the largest strongly connected component of count matrix C """
+    from scipy.sparse.csgraph import connected_components
+    _, components = connected_components(C, directed=True, connection='strong')
+    return np.flatnonzero(components == np.argmax(np.bincount(components)))
+
+
+@njit(parallel=True, cache=True)
+def _mleIterate(indptr, indices, s, c, x, maxiter, tol):
+    # Fixed-point iteration x_ij = (c_ij + c_ji) / (c_i / x_i + c_j / x_j) over the rows of the CSR matrix C + C^T
+    n = len(x)
+    xij = np.empty(len(s))
+    for _ in range(maxiter):
+        xnew = np.zeros(n)
+        for i in prange(n):
+            rowsum = 0.0
+            for k in range(indptr[i], indptr[i + 1]):
+                j = indices[k]
+                xij[k] = s[k] / (c[i] / x[i] + c[j] / x[j])
+                rowsum += xij[k]
+            xnew[i] = rowsum
+        oldsum = x.sum()
+        newsum = xnew.sum()
+        err = 0.0
+        for i in range(n):
+            err = max(err, abs(xnew[i] / newsum - x[i] / oldsum))
+        x = xnew
+        if err < tol:
+            break
+    return xij, x
+
+
+def _reversibleMLE(C, maxiter=1000000, tol=1e-8):
+    """ Reversible maximum likelihood estimate of a connected count matrix C by fixed-point iteration
+
+    Returns the symmetric matrix X of the estimated joint probabilities (T = X / x) as a sparse COO matrix and its
+    row sums x.
+    """
+    from scipy.sparse import csr_matrix, coo_matrix
+    C = csr_matrix(C, dtype=np.float64)
+    S = (C + C.T).tocsr()
+    S.sort_indices()
+    n = C.shape[0]
+    c = np.asarray(C.sum(axis=1)).ravel()
+    x = np.asarray(S.sum(axis=1)).ravel()
+    xij, x = _mleIterate(S.indptr, S.indices, S.data, c, x, maxiter, tol)
+    rows = np.repeat(np.arange(n), np.diff(S.indptr))
+    return coo_matrix((xij, (rows, S.indices)), shape=(n, n)), x
+
+
+def _impliedTimescales(C, lag, nits):
+    """ The `nits` implied timescales of the reversible MSM of the largest connected set of count matrix C.
+    Missing timescales are NaN. """
+    active = _largestConnectedSet(C)
+    if len(active) < 2:
+        return np.full(nits, np.nan)
+    X, x = _reversibleMLE(C[active][:, active])
+    return _timescales(X, x, lag, nits)
+
+
+def _timescales(X, x, lag, nits):
+    """ The `nits` implied timescales of the reversible MSM given by _reversibleMLE. Missing timescales are NaN. """
+    timescales = np.full(nits, np.nan)
+    n = len(x)
+    # The eigenvalues of T are those of the symmetric matrix X_ij / sqrt(x_i x_j)
+    d = 1 / np.sqrt(x)
+    S = X.multiply(d[:, None]).multiply(d[None, :]).tocsr()
+    k = min(nits + 1, n)
+    if n <= 1000 or k >= n - 1:
+        from scipy.linalg import eigvalsh
+        evals = eigvalsh(S.toarray())
+    else:
+        from scipy.sparse.linalg import eigsh
+        evals = eigsh(S, k=k, which='LM', return_eigenvectors=False)
+    evals = evals[np.argsort(-np.abs(evals))][1:k]
+    timescales[:len(evals)] = -lag / np.log(np.abs(evals))
+    return timescales
+
+
+def _mfpt(X, x, origin, target):
+    """ Mean first passage time in lag times from the states `origin` to the states `target` of the reversible MSM
+    given by _reversibleMLE, averaged over the origin states with their equilibrium probabilities """
+    from scipy.sparse import csr_matrix, identity
+    from scipy.sparse.linalg import spsolve
+    n = len(x)
+    if len(origin) == 0 or len(target) == 0:
+        return np.nan
+    T = csr_matrix(X.multiply(1 / x[:, None]))
+    others = np.setdiff1d(np.arange(n), target)
+    m = np.zeros(n)
+    if len(others):
+        A = identity(len(others), format='csc') - T[others][:, others].tocsc()
+        m[others] = spsolve(A, np.ones(len(others)))
+    return np.sum(x[origin] * m[origin]) / np.sum(x[origin])
+
+
+def _trajectoryCountMatrices(labels, ends, lag, numstates, chunksize=1000000):
+    """ Sliding-window counts of each trajectory at one lag time as a sparse matrix with one row per trajectory and
+    the flattened (numstates x numstates) count matrix in the columns """
+    from scipy.sparse import csr_matrix
+    labels = np.ascontiguousarray(labels, dtype=np.int64)
+    ends = np.ascontiguousarray(ends, dtype=np.int64)
+    lags = np.array([lag], dtype=np.int64)
+    counts = csr_matrix((len(ends), numstates * numstates), dtype=np.int64)
+    keys = np.empty((1, min(chunksize, len(labels))), dtype=np.int64)
+    for start in range(0, len(labels), chunksize):
+        stop = min(start + chunksize, len(labels))
+        _lagKeys(labels, ends, lags, start, stop, numstates, keys)
+        k = keys[0, :stop - start]
+        valid = k >= 0
+        traj = np.searchsorted(ends, np.arange(start, stop)[valid], side='right')
+        counts = counts + csr_matrix((np.ones(len(traj), dtype=np.int64), (traj, k[valid])), shape=counts.shape)
+    return counts
+
+
+def _weightedCounts(counts, weights, numstates):
+    """ The (numstates x numstates) count matrix of the sum of the trajectory counts weighted by `weights` """
+    from scipy.sparse import csr_matrix
+    flat = csr_matrix(weights).dot(counts).tocoo()
+    return csr_matrix((flat.data, (flat.col // numstates, flat.col % numstates)), shape=(numstates, numstates))
+
+
+def _bootstrapTimescales(counts, weights, numstates, lag, nits):
+    """ The implied timescales in frames of the MSM of the weighted sum of the trajectory counts for each row of
+    `weights`. Missing timescales are NaN. """
+    return np.vstack([_impliedTimescales(_weightedCounts(counts, w, numstates), lag, nits) for w in weights])
+
+
+def _bootstrapReplicates(counts, weights, numstates, lag, nits, memberships, sourceclusters, sinkclusters):
+    """ Estimates the reversible MSM of the weighted sum of the trajectory counts for each row of `weights`
+
+    Returns the implied timescales in frames, the equilibrium probabilities of the macrostates given by the cluster
+    `memberships` and the MFPTs in lag times between the source and sink clusters of each replicate. The active set of
+    each replicate is its own largest connected set.
+    """
+    numsamples = weights.shape[0]
+    timescales = np.full((numsamples, nits), np.nan)
+    macroeq = np.full((numsamples, memberships.shape[1]), np.nan)
+    mfpton = np.full(numsamples, np.nan)
+    mfptoff = np.full(numsamples, np.nan)
+    for i in range(numsamples):
+        C = _weightedCounts(counts, weights[i], numstates)
+        active = _largestConnectedSet(C)
+        if len(active) < 2:
+            continue
+        X, x = _reversibleMLE(C[active][:, active])
+        timescales[i] = _timescales(X, x, lag, nits)
+        eq = (x / x.sum()).dot(memberships[active])
+        macroeq[i] = eq / eq.sum()
+        source = np.flatnonzero(np.isin(active, sourceclusters))
+        sink = np.flatnonzero(np.isin(active, sinkclusters))
+        mfpton[i] = _mfpt(X, x, source, sink)
+        mfptoff[i] = _mfpt(X, x, sink, source)
+    return timescales, macroeq, mfpton, mfptoff
+
+
 '''def _macroP(C, macro_ofmicro):
     macronum = np.max(macro_ofmicro) + 1
     macroC = np.zeros((macronum, macronum))
@@ -1231,6 +1761,141 @@ class _TestModel(unittest.TestCase):
         assert newmodel.data.parent.numTrajectories == 2
         self.model.data.parent = None
 
+    def test_count_matrices(self):
+        data = self.model.data
+        for lag, C in zip([1, 5], self.model._countMatrices([1, 5])):
+            expected = np.zeros((data.K, data.K), dtype=int)
+            for st in data.St:
+                np.add.at(expected, (st[:-lag], st[lag:]), 1)
+            assert np.array_equal(C.toarray(), expected)
+        assert self.model._countMatrices([5])[0] is C
+        trajcounts = self.model._trajectoryCountMatrices(5)
+        assert trajcounts.shape == (data.numTrajectories, data.K * data.K)
+        assert np.array_equal(np.asarray(trajcounts.sum(axis=0)).reshape(data.K, data.K), C.toarray())
+
+    @staticmethod
+    def _simulateChain(K, numtraj, length, rng):
+        # Discrete trajectories of the Markov chain with transition matrix proportional to K
+        cumT = np.cumsum(K / K.sum(axis=1)[:, None], axis=1)
+        trajs = []
+        for _ in range(numtraj):
+            st = [rng.randint(K.shape[0])]
+            for u in rng.rand(length - 1):
+                st.append(min(np.searchsorted(cumT[st[-1]], u), K.shape[0] - 1))
+            trajs.append(np.array(st))
+        return trajs
+
+    def test_count_cache(self):
+        from unittest import mock
+        from htmd.metricdata import MetricData
+        from htmd.clustering.kcenters import KCenter
+        import htmd.model
+        K = np.full((6, 6), 0.01)
+        K[:3, :3] = K[3:, 3:] = 1
+        trajs = [st.astype(np.float32)[:, None] for st in self._simulateChain(K, 5, 1000, np.random.RandomState(0))]
+        data = MetricData(dat=trajs, fstep=0.1)
+        data.cluster(KCenter(n_clusters=6))
+        model = Model(data)
+        with mock.patch('htmd.model._countMatrices', wraps=htmd.model._countMatrices) as counter:
+            model.markovModel(5, 2, backend='native')
+            C = model._countMatrices([5])[0]
+            model.impliedTimescales([1, 5], nits=2, njobs=1)
+            model.markovModel(5, 2, backend='native')
+            # Every lag time is counted only once over the trajectories
+            assert [c[0][2] for c in counter.call_args_list] == [[5], [1]]
+        assert model._countMatrices([5])[0] is C
+
+    def test_implied_timescales(self):
+        its = self.model.impliedTimescales([1, 2, 5], nits=2, njobs=1)
+        assert its.timescales.shape == (3, 2)
+        assert np.array_equal(self.model.impliedTimescales([5], nits=2).get(5), its.get(5), equal_nan=True)
+        assert sorted(self.model._itscache[1].keys()) == [1, 2, 5]
+        errors = self.model.impliedTimescales([1, 2, 5], nits=2, errors=10, seed=0, njobs=1).errors
+        assert errors.shape == (3, 2)
+        assert np.array_equal(self.model.impliedTimescales([2], nits=2, errors=10).errors[0], errors[1], equal_nan=True)
+
+    def test_bootstrap(self):
+        from htmd.metricdata import MetricData
+        from htmd.kinetics import Kinetics
+        from htmd.clustering.kcenters import KCenter
+        # Toy dataset of a 6 state chain with two metastable sets of 3 states
+        K = np.full((6, 6), 0.01)
+        K[:3, :3] = K[3:, 3:] = 1
+        trajs = [st.astype(np.float32)[:, None] for st in self._simulateChain(K, 20, 2000, np.random.RandomState(0))]
+        data = MetricData(dat=trajs, fstep=0.1)
+        data.cluster(KCenter(n_clusters=6))
+        model = Model(data)
+        model.markovModel(1, 2, backend='native')
+        kin = Kinetics(model, temperature=300, source=0, sink=1)
+
+        boot = kin.bootstrap(20, nits=2, njobs=1, seed=0)
+        assert boot.timescales.shape == (20, 2)
+        assert boot.eq.shape == (20, 2)
+        for rate in ('mfpton', 'mfptoff', 'kon', 'koff', 'g0eq', 'kdeq'):
+            assert len(getattr(boot, rate)) == 20
+        assert np.array_equal(kin.bootstrap(20, nits=2, njobs=1, seed=0).koff, boot.koff)
+
+        rates = kin.getRates()
+        assert np.allclose(np.mean(boot.eq, axis=0), model.eqDistribution(plot=False), atol=0.05)
+        assert np.isclose(np.mean(boot.mfpton), rates.mfpton, rtol=0.1)
+        assert np.isclose(np.mean(boot.mfptoff), rates.mfptoff, rtol=0.1)
+        assert np.isclose(np.mean(boot.g0eq), rates.g0eq, atol=0.1)
+
+        assert kin.bootstrap(20, source=0, sink=0, nits=2, njobs=1).koff is None
+        with self.assertRaises(ValueError):
+            kin.bootstrap(20, source=0, sink=[], nits=2, njobs=1)
+
+        # Only the first trajectory leaves the first metastable set. Samples without it cannot have rates.
+        for traj in trajs[1:]:
+            traj[:] = traj % 3
+        data = MetricData(dat=trajs, fstep=0.1)
+        data.cluster(KCenter(n_clusters=6))
+        model = Model(data)
+        model.markovModel(1, 2, backend='native')
+        kin = Kinetics(model, temperature=300, source=0, sink=1)
+        boot = kin.bootstrap(20, nits=2, njobs=1, seed=0)
+        missing = np.isnan(boot.mfpton)
+        assert 0 < np.sum(missing) < 20
+        for rate in ('mfptoff', 'kon', 'koff', 'g0eq', 'kdeq'):
+            assert np.array_equal(np.isnan(getattr(boot, rate)), missing)
+            assert np.all(np.isfinite(getattr(boot, rate)[~missing]))
+
+    def test_native_pcca(self):
+        # Toy chain of 9 states in 3 metastable sets. The reference values were calculated with pyemma 2.5.12
+        rng = np.random.RandomState(0)
+        K = rng.rand(9, 9)
+        K[np.arange(9)[:, None] // 3 != np.arange(9)[None, :] // 3] *= 0.01
+        K += K.T
+        trajs = self._simulateChain(K, 10, 3000, rng)
+        C = _countMatrices(np.concatenate(trajs), np.cumsum([len(t) for t in trajs]), [2], 9)[0]
+        msm = _NativeMSM(C, 2).pcca(3)
+
+        refpi = [0.138290, 0.160176, 0.181036, 0.106232, 0.112783, 0.100311, 0.047337, 0.085954, 0.067882]
+        refchi = [[0.008264, 0.005682, 0.986054],
+                  [0.000011, 0.000444, 0.999545],
+                  [0.000951, 0.000000, 0.999049],
+                  [0.000309, 0.992123, 0.007568],
+                  [0.000000, 0.993870, 0.006130],
+                  [0.001263, 0.998732, 0.000005],
+                  [0.982429, 0.006678, 0.010893],
+                  [0.999986, 0.000014, 0.000000],
+                  [0.980307, 0.000580, 0.019113]]
+        assert np.allclose(msm.stationary_distribution, refpi, atol=1e-6)
+        assert np.allclose(msm.metastable_memberships, refchi, atol=1e-5)
+        assert np.array_equal(msm.metastable_assignments, [2, 2, 2, 1, 1, 1, 0, 0, 0])
+        assert np.allclose(_timescales(msm._X, msm._x, 2, 2), [37.774211, 34.072226], rtol=1e-5)
+
+    def test_native_backend(self):
+        native = Model(self.model.data)
+        native.markovModel(5, 2, backend='native')
+        reference = Model(self.model.data)
+        reference.markovModel(5, 2)
+
+        assert np.array_equal(native.msm.active_set, reference.msm.active_set)
+        assert np.allclose(native.msm.stationary_distribution, reference.msm.stationary_distribution, atol=1e-5)
+        assert np.allclose(native.P, reference.P, atol=1e-5)
+        assert native.macronum == reference.macronum
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)
 
@@ -10,10 +10,69 @@ from joblib import Parallel, delayed  # Import delayed as well for other modules
 A wrapper for joblib.Parallel to allow custom progress bars.
 """
 
+import numpy as np
 from tqdm import tqdm
 
-def ParallelExecutor(**joblib_args):
+_BACKENDS = {'processes': 'loky', 'threads': 'threading'}
+
+
+def ParallelExecutor(cost=None, generator=False, **joblib_args):
+    """ Creates a joblib.Parallel executor with a progress bar
+
+    Parameters
+    ----------
+    cost : list
+        An estimate of the cost of each task (i.e. number of frames to process). Tasks are submitted from the most
+        to the least expensive to avoid long tasks submitted last delaying the end of the run. Results are still
+        returned in the original task order.
+    generator : bool
+        If True, the executor returns a generator which yields (index, result) tuples as soon as each task finishes
+        instead of a list of all results.
+    joblib_args :
+        Arguments passed on to joblib.Parallel, i.e. n_jobs or batch_size. The backend can also be given as
+        'processes' or 'threads'.
+
+    Examples
+    --------
+    >>> aprun = ParallelExecutor(n_jobs=4, cost=[len(x) for x in tasks])
+    >>> results = aprun(total=len(tasks), desc='Working')(delayed(foo)(x) for x in tasks)
+    """
+    if joblib_args.get('backend') in _BACKENDS:
+        joblib_args['backend'] = _BACKENDS[joblib_args['backend']]
+
     def aprun(**tq_args):
-        tqdm_f = lambda x, args: tqdm(x, **args)
-        return lambda x: Parallel(**joblib_args)(tqdm_f(x, tq_args))
-    return aprun
\ No newline at end of file
+        def run(tasks):
+            tasks = list(tasks)
+            order = np.arange(len(tasks))
+            if cost is not None:
+                order = np.argsort(-np.asarray(cost, dtype=float), kind='stable')
+
+            if generator:
+                return _generate(tasks, order, joblib_args, tq_args)
+
+            results = Parallel(**joblib_args)(tqdm([tasks[i] for i in order], **tq_args))
+            ordered = [None] * len(tasks)
+            for i, r in zip(order, results):
+                ordered[i] = r
+            return ordered
+        return run
+    return aprun
+
+
+def _generate(tasks, order, joblib_args, tq_args):
+    indexed = [delayed(_indexedCall)(int(i), tasks[i]) for i in order]
+    try:
+        results = Parallel(return_as='generator_unordered', **joblib_args)(indexed)
+    except TypeError:  # Older joblib versions can only return all results at the end
+        results = Parallel(**joblib_args)(indexed)
+
+    tq_args.setdefault('total', len(tasks))
+    with tqdm(**tq_args) as pbar:
+        for i, r in results:
+            pbar.update(1)
+            yield i, r
+
+
+def _indexedCall(i, task):
+    func, args, kwargs = task
+    return i, func(*args, **kwargs)
@@ -25,6 +25,12 @@ class GWPCA(object):
     ----------
     data : :class:`MetricData <htmd.metricdata.MetricData>` object
         The object whose data we wish to project.
+    lag : int
+        The lag time at which the autocorrelation of each feature is calculated to weight it
+    units : str
+        The units of lag. Can be 'frames' or any time unit given as a string.
+    chunksize : int
+        Number of frames processed at a time when calculating the weights and the PCA
 
     Example
     -------
@@ -32,21 +38,36 @@ class GWPCA(object):
     >>> dataproj = gw.project(5)
     """
 
-    def __init__(self, data, lag, units='frames'):
+    def __init__(self, data, lag, units='frames', chunksize=10000):
         lag = unitconvert(units, 'frames', lag, data.fstep)
         if lag == 0:
             raise RuntimeError('Lag time conversion resulted in 0 frames. Please use a larger lag-time for TICA.')
         self.data = data
-
-        datconcat = np.concatenate(self.data.dat)
-        self.weights = self._autocorrelation(datconcat, lag)
-
-    def _autocorrelation(self, data, lag):
-        # Calculate the autocorrelation of each feature
-        autocorr = []
-        for i in range(data.shape[1]):
-            autocorr.append(np.correlate(data[0:-lag, i], data[lag:, i]))
-        return np.squeeze(autocorr)
+        self.chunksize = chunksize
+        self.weights = self._autocorrelation(lag)
+
+    def _chunks(self):
+        """ Yields the index of the trajectory and its consecutive chunks of frames in float32 """
+        for i, t in enumerate(self.data.trajectories):
+            proj = t.projection
+            for start in range(0, proj.shape[0], self.chunksize):
+                yield i, np.asarray(proj[start:start + self.chunksize], dtype=np.float32)
+
+    def _autocorrelation(self, lag):
+        # Sum of the lagged products of each feature within each trajectory. The last `lag` frames of each chunk are
+        # carried over to pair them with the next chunk of the same trajectory.
+        autocorr = np.zeros(self.data.numDimensions)
+        carry = None
+        previous = None
+        for i, chunk in self._chunks():
+            if i != previous or carry is None:
+                carry = chunk[:0]
+                previous = i
+            frames = np.concatenate((carry, chunk)) if carry.shape[0] else chunk
+            if frames.shape[0] > lag:
+                autocorr += np.einsum('ij,ij->j', frames[:-lag], frames[lag:], dtype=np.float64)
+            carry = frames[-lag:]
+        return autocorr.astype(np.float32)
 
     def project(self, ndim=None):
         """ Projects the data object given to the constructor onto `ndim` dimensions
@@ -69,15 +90,29 @@ class GWPCA(object):
         from sklearn.decomposition import IncrementalPCA
         from tqdm import tqdm
 
-        pca = IncrementalPCA(n_components=ndim, batch_size=10000)
-        for t in tqdm(self.data.trajectories):
-            pca.partial_fit(t.projection * self.weights)
-
+        # Chunks are grouped into batches of at least `chunksize` frames since IncrementalPCA needs more frames than
+        # components in every batch. The last full batch is held back until the end so that the leftover frames can
+        # be merged into it.
+        pca = IncrementalPCA(n_components=ndim)
+        pending = []
+        batch = []
+        batchframes = 0
+        for _, chunk in tqdm(self._chunks(), desc='Fitting PCA'):
+            batch.append(chunk * self.weights)
+            batchframes += chunk.shape[0]
+            if batchframes >= self.chunksize:
+                if len(pending):
+                    pca.partial_fit(np.concatenate(pending))
+                pending = batch
+                batch = []
+                batchframes = 0
+        pca.partial_fit(np.concatenate(pending + batch))
+
+        projected = [[] for _ in range(self.data.numTrajectories)]
+        for i, chunk in tqdm(self._chunks(), desc='Projecting PCA'):
+            projected[i].append(pca.transform(chunk * self.weights).astype(np.float32))
 
         projdata = self.data.copy()
-        for i, t in enumerate(tqdm(self.data.trajectories)):
-            projdata.trajectories[i].projection = pca.transform(t.projection * self.weights)
-
-        # projdataconc = pca.fit_transform(self.weighedconcat)
-        # projdata.dat = projdata.deconcatenate(projdataconc)
+        for i, proj in enumerate(projected):
+            projdata.trajectories[i].projection = np.concatenate(proj) if len(proj) else np.zeros((0, pca.n_components_), dtype=np.float32)
         return projdata
@@ -15,7 +15,9 @@ class KMeansTri(object):
     Parameters
     ----------
     data : :class:`MetricData <htmd.metricdata.MetricData>` object
-        The object whose data we wish to project.
+        The object whose data we wish to project. It can be lazily loaded.
+    chunksize : int
+        Number of frames processed at a time when fitting the centers and calculating the distances to them
 
     Example
     -------
@@ -23,8 +25,16 @@ class KMeansTri(object):
     >>> dataproj = tri.project(50)
     """
 
-    def __init__(self, data):
+    def __init__(self, data, chunksize=10000):
         self.data = data
+        self.chunksize = chunksize
+
+    def _chunks(self):
+        """ Yields the index of the trajectory, the first frame and the next chunk of frames of each trajectory """
+        for i, t in enumerate(self.data.trajectories):
+            proj = t.projection
+            for start in range(0, proj.shape[0], self.chunksize):
+                yield i, start, proj[start:start + self.chunksize]
 
     def project(self, ndim=None):
         """ Projects the data object given to the constructor onto `ndim` dimensions
@@ -47,15 +57,30 @@ class KMeansTri(object):
         import scipy.spatial.distance as scidist
         from sklearn.cluster import MiniBatchKMeans
         from htmd.metricdata import MetricData
+        from tqdm import tqdm
 
-        datconcat = np.concatenate(self.data.dat)
+        # Chunks are grouped into batches of at least `chunksize` frames and `ndim` frames for the first partial_fit
         mb = MiniBatchKMeans(n_clusters=ndim)
-        mb.fit(datconcat)
+        batch = []
+        batchframes = 0
+        for _, _, chunk in tqdm(self._chunks(), desc='Fitting centers'):
+            batch.append(chunk)
+            batchframes += chunk.shape[0]
+            if batchframes >= max(self.chunksize, ndim):
+                mb.partial_fit(np.concatenate(batch))
+                batch = []
+                batchframes = 0
+        if batchframes and (hasattr(mb, 'cluster_centers_') or batchframes >= ndim):
+            mb.partial_fit(np.concatenate(batch))
+        centers = mb.cluster_centers_
 
-        # TODO: Could make it into a loop to waste less memory
-        dist = scidist.cdist(datconcat, mb.cluster_centers_)
-        dist = np.mean(dist, axis=1)[:, np.newaxis] - dist
-        dist[dist < 0] = 0
+        dat = np.empty(self.data.numTrajectories, dtype=object)
+        dat[:] = [np.empty((t.numFrames, ndim), dtype=np.float32) for t in self.data.trajectories]
+        for i, start, chunk in tqdm(self._chunks(), desc='Calculating distances'):
+            dist = scidist.cdist(chunk, centers)
+            dist = np.mean(dist, axis=1)[:, np.newaxis] - dist
+            dist[dist < 0] = 0
+            dat[i][start:start + chunk.shape[0]] = dist
 
-        return MetricData(dat=self.data.deconcatenate(dist), ref=self.data.ref, simlist=self.data.simlist,
+        return MetricData(dat=dat, ref=self.data.ref, simlist=self.data.simlist,
                           fstep=self.data.fstep, parent=self.data)
@@ -4,6 +4,7 @@
 # Distributed under HTMD Software License Agreement
 # No redistribution in whole or part
 #
+import os
 import numpy as np
 from moleculekit.molecule import Molecule
 from htmd.metricdata import MetricData
@@ -101,7 +102,7 @@ class Metric:
                 pandamap = pandamap.append(proj.getMapping(mol), ignore_index=True)
         return pandamap
 
-    def project(self, njobs=None):
+    def project(self, njobs=None, cache=None, chunksize=None, atomsubset=False, shardframes=None, outdir=None):
         """
         Applies all projections stored in Metric on all simulations.
 
@@ -110,6 +111,30 @@ class Metric:
         njobs : int
             Number of parallel jobs to spawn for projection of trajectories. Take care that this can use large amounts 
             of memory as multiple trajectories are loaded at once.  If None it will use the default from htmd.config.
+        cache : str
+            Path to a directory in which to cache the projection of each trajectory. Trajectories whose files,
+            topology, `skip` and projections have not changed since the last call are read from the cache instead of
+            being projected again. Useful for adaptive runs where only the newest simulations need projecting.
+        chunksize : int
+            If given, simulations are read and projected in windows of consecutive trajectory pieces containing up to
+            `chunksize` frames instead of loading whole simulations at once. This bounds the memory used by each job.
+            Only use it with projections that do not depend on other frames of the trajectory (i.e. not
+            MetricFluctuation without a reference).
+        atomsubset : bool
+            If True, only the atoms used by the projections are kept in memory after reading each trajectory piece.
+            The atoms are the union of the cached atom selections of all Projection objects. Requires a single
+            topology for all simulations and cannot be used with function projections. Reduces the memory usage
+            considerably on unfiltered (i.e. solvated) simulations.
+        shardframes : int
+            If given, simulations longer than `shardframes` frames are split into shards of consecutive trajectory
+            pieces of about that many frames which are projected in parallel and stitched back together in order.
+            When projecting a single Molecule, its frames are split into shards of `shardframes` frames. Useful for
+            datasets of few very long trajectories. Only use it with projections that do not depend on other frames of
+            the trajectory.
+        outdir : str
+            If given, each job writes the projection and reference arrays of its trajectory to .npy files in this
+            directory instead of sending them back to the main process. The returned MetricData is backed by read-only
+            memory-mapped views of these files, so the directory needs to be kept as long as the data is used.
 
         Returns
         -------
@@ -119,16 +144,32 @@ class Metric:
         if len(self.projectionlist) == 0:
             raise RuntimeError('You need to provide projections using the Metric.set method.')
 
+        from htmd.config import _config
+        njobs = njobs if njobs is not None else _config['njobs']
+
         # Projecting single Molecules
         if isinstance(self.simulations, Molecule):
-            data = []
             mol = self.simulations
-            for proj in self.projectionlist:
-                data.append(_project(proj, mol))
-            return data
+            if shardframes is None or mol.numFrames <= shardframes:
+                data = []
+                for proj in self.projectionlist:
+                    data.append(_project(proj, mol))
+                return data
+
+            shards = [np.arange(i, min(i + shardframes, mol.numFrames)) for i in range(0, mol.numFrames, shardframes)]
+            # The frames are sliced inside the jobs so that the parent never holds copies of all shards at once. joblib
+            # memory-maps the coordinates when sending them to worker processes instead of copying them for every job
+            aprun = ParallelExecutor(n_jobs=njobs)
+            results = aprun(total=len(shards), desc='Projecting frames')(delayed(_projectShard)(mol, fr, self.projectionlist) for fr in shards)
+            return [np.concatenate([r[i] for r in results]) for i in range(len(self.projectionlist))]
 
         numSim = len(self.simulations)
 
+        projhash = None
+        if cache is not None:
+            os.makedirs(cache, exist_ok=True)
+            projhash = _projectionHash(self.projectionlist)
+
         # Find out if there is a unique molfile. If there is, initialize a single Molecule to speed up calculations
         uqMol = None
         (single, molfile) = _singleMolfile(self.simulations)
@@ -141,10 +182,35 @@ class Metric:
             logger.warning('Cannot calculate description of dimensions due to different topology files for each trajectory.')
         mapping = self.getMapping(uqMol)
 
+        atoms = None
+        projectionlist = self.projectionlist
+        if atomsubset:
+            if uqMol is None:
+                logger.warning('Cannot use atomsubset with different topology files for each trajectory. Reading all atoms.')
+            else:
+                atoms, projectionlist = _atomSubset(self.projectionlist, uqMol)
+
+        tasks = []
+        for i in range(numSim):
+            shards = [None] if shardframes is None else _simShards(self.simulations[i], shardframes)
+            tasks += [(i, shard) for shard in shards]
+
+        outfiles = None
+        taskfiles = [None] * len(tasks)
+        if outdir is not None:
+            os.makedirs(outdir, exist_ok=True)
+            outfiles = [os.path.join(outdir, 'traj{}'.format(i)) for i in range(numSim)]
+            taskfiles = [outfiles[i] if shard is None else '{}.shard{}'.format(outfiles[i], shard[1]) for i, shard in tasks]
+
         logger.debug('Metric: Starting projection of trajectories.')
-        from htmd.config import _config
-        aprun = ParallelExecutor(n_jobs=njobs if njobs is not None else _config['njobs'])
-        results = aprun(total=numSim, desc='Projecting trajectories')(delayed(_processSim)(self.simulations[i], self.projectionlist, uqMol, self.skip) for i in range(numSim))
+        aprun = ParallelExecutor(n_jobs=njobs, cost=[_taskCost(self.simulations[i], shard) for i, shard in tasks], generator=True)
+        results = [None] * len(tasks)
+        for k, res in aprun(total=len(tasks), desc='Projecting trajectories')(delayed(_processSim)(self.simulations[i], projectionlist, uqMol, self.skip, cache, projhash, chunksize, atoms, shard, outf) for (i, shard), outf in zip(tasks, taskfiles)):
+            results[k] = res
+        if len(tasks) != numSim:
+            results = _stitchShards(results, [i for i, _ in tasks], outfiles)
+        if outdir is not None:
+            results = [r if r[3] else (np.load(r[0], mmap_mode='r'), np.load(r[1], mmap_mode='r')) + r[2:] for r in results]
 
         metrics = np.empty(numSim, dtype=object)
         ref = np.empty(numSim, dtype=object)
@@ -239,35 +305,348 @@ def _highfreqFilter(mol,steps):
     mol.coords=X
 
 
-def _processSim(sim, projectionlist, uqmol, skip):
+def _processSim(sim, projectionlist, uqmol, skip, cache=None, projhash=None, chunksize=None, atoms=None, shard=None,
+                outfile=None):
+    results = _projectSim(sim, projectionlist, uqmol, skip, cache, projhash, chunksize, atoms, shard)
+    if outfile is None or results[3]:
+        return results
+    # Write the results to disk and only return their location to avoid sending them back to the parent process
+    return _saveShard(outfile, results[0], results[1]) + results[2:]
+
+
+def _projectSim(sim, projectionlist, uqmol, skip, cache=None, projhash=None, chunksize=None, atoms=None, shard=None):
     pieces = sim.trajectory
-    try:
-        if uqmol is not None:
-            mol = uqmol.copy()
-        else:
-            mol = Molecule(sim.molfile)
-        logger.debug(pieces[0])
+    cachefile = None
+    if cache is not None:
+        try:
+            cachefile = os.path.join(cache, '{}.npz'.format(_cacheKey(sim, skip, projhash, shard)))
+        except OSError as e:
+            logger.warning(f'Cannot cache projection of simulation id: {sim.simid}. "{e}"')
+        if cachefile is not None and os.path.exists(cachefile):
+            try:
+                return _loadCached(cachefile)
+            except Exception as e:
+                logger.warning(f'Corrupted projection cache file {cachefile}. Reprojecting simulation id: {sim.simid}. "{e}"')
+
+    pieceidx, numread = (list(range(len(pieces))), 0) if shard is None else shard
+    if chunksize is None:
+        windows = [pieceidx]
+    else:
+        windows = _pieceWindows(sim, chunksize, pieceidx)
 
-        mol.read(pieces, skip=skip)
- 
+    try:
         data = []
-        for proj in projectionlist:
-            result = _project(proj, mol)
-            if result.ndim == 1:
-                result = np.atleast_2d(result).T
-            if result.size == 0:
-                logger.warning(f'No data was produced by projection {proj.__class__} of simulation id: {sim.simid}')
-            data.append(result)
-
-        data = np.hstack(data)
-        if data.dtype == np.float64:
-            data = data.astype(np.float32)
-
+        ref = []
+        fstep = None
+        for window in windows:
+            logger.debug(pieces[window[0]])
+            mol, framesread = _readWindow(sim, uqmol, [pieces[i] for i in window], skip, numread, atoms)
+            numread += framesread
+            if mol is None:
+                continue
+            data.append(_projectMol(mol, projectionlist, sim))
+            ref.append(_calcRef(pieces, mol.fileloc))
+            if fstep is None and mol.numFrames > 1:  # Windows of a single frame have no frame step
+                fstep = mol.fstep
+        data = np.concatenate(data)
+        ref = np.concatenate(ref)
     except Exception as e:
         logger.warning(f'Error while projecting simulation id: {sim.simid}. "{e}"')
         return None, None, None, True
 
-    return data, _calcRef(pieces, mol.fileloc), mol.fstep, False
+    if cachefile is not None:
+        _saveCached(cachefile, data, ref, fstep)
+    return data, ref, fstep, False
+
+
+def _saveShard(outfile, data, ref):
+    projfile = '{}.projection.npy'.format(outfile)
+    reffile = '{}.reference.npy'.format(outfile)
+    np.save(projfile, data)
+    np.save(reffile, ref)
+    return projfile, reffile
+
+
+def _simMolecule(sim, uqmol):
+    if uqmol is not None:
+        return uqmol.copy()
+    return Molecule(sim.molfile)
+
+
+def _readWindow(sim, uqmol, pieces, skip, offset, atoms):
+    # Reads the given trajectory pieces. `offset` is the number of frames of the simulation read before these pieces,
+    # used for skipping frames globally over the whole simulation, as mol.read does.
+    if atoms is None:
+        mol = _simMolecule(sim, uqmol)
+        mol.read(pieces)
+    else:  # Read one piece at a time and only keep the atoms used by the projections
+        mol = None
+        for p in pieces:
+            piecemol = _simMolecule(sim, uqmol)
+            piecemol.read(p)
+            piecemol.filter(atoms, _logger=False)
+            if mol is None:
+                mol = piecemol
+            else:
+                mol.appendFrames(piecemol)
+
+    framesread = mol.numFrames
+    if skip is not None and skip > 1:
+        keep = np.arange((-offset) % skip, framesread, skip)
+        if len(keep) == 0:
+            return None, framesread
+        mol.dropFrames(keep=keep)
+    return mol, framesread
+
+
+def _atomSubset(projectionlist, mol):
+    """ Finds the atoms of `mol` used by the projections and returns copies of the projections caching their
+    selections on the subset of these atoms. Returns None as atoms if the subset cannot be used safely. """
+    from copy import deepcopy
+    if not np.all([isinstance(proj, Projection) and hasattr(proj, '_cache') for proj in projectionlist]):
+        logger.warning('atomsubset can only be used with Projection objects. Reading all atoms.')
+        return None, projectionlist
+
+    atoms = [np.zeros(0, dtype=int)]
+    for proj in projectionlist:
+        atoms += _cacheAtoms(proj._cache, mol.numAtoms)
+    atoms = np.unique(np.concatenate(atoms))
+    if len(atoms) == 0 or len(atoms) == mol.numAtoms:
+        return None, projectionlist
+
+    submol = mol.copy()
+    submol.filter(atoms, _logger=False)
+    subprojectionlist = []
+    for proj in projectionlist:
+        subproj = deepcopy(proj)
+        subproj._cache = {}
+        try:
+            subproj._setCache(submol)
+        except Exception as e:
+            logger.warning(f'Selections of projection {proj.__class__.__name__} cannot be evaluated on the subset of '
+                           f'atoms used by the projections. Reading all atoms. "{e}"')
+            return None, projectionlist
+        # Selections are re-evaluated on the subset. Make sure they still select the same atoms as on the full system
+        if not _cacheMatches(proj._cache, subproj._cache, atoms):
+            logger.warning(f'Selections of projection {proj.__class__.__name__} change when evaluated on the subset '
+                           f'of atoms used by the projections. Reading all atoms.')
+            return None, projectionlist
+        subprojectionlist.append(subproj)
+
+    logger.info(f'Projections use {len(atoms)} of {mol.numAtoms} atoms. Only these will be kept in memory.')
+    return atoms, subprojectionlist
+
+
+def _cacheAtoms(value, numatoms):
+    # Collects all atom indexes stored as boolean masks or integer index arrays in a projection cache
+    if isinstance(value, dict):
+        return [x for v in value.values() for x in _cacheAtoms(v, numatoms)]
+    if isinstance(value, (list, tuple)):
+        try:
+            value = np.asarray(value)
+        except ValueError:  # Ragged lists
+            return [x for v in value for x in _cacheAtoms(v, numatoms)]
+        if value.dtype == object:
+            return [x for v in value for x in _cacheAtoms(v, numatoms)]
+    if not isinstance(value, np.ndarray):
+        return []
+    if value.dtype == bool and value.ndim > 0 and value.shape[-1] == numatoms:
+        return [np.where(np.any(value.reshape(-1, numatoms), axis=0))[0]]
+    if np.issubdtype(value.dtype, np.integer) and value.size and value.min() >= 0 and value.max() < numatoms:
+        return [value.flatten()]
+    return []
+
+
+def _cacheMatches(full, sub, atoms):
+    # Checks that the cached value `sub` computed on the subset `atoms` corresponds to `full` computed on all atoms
+    if isinstance(full, dict):
+        return isinstance(sub, dict) and full.keys() == sub.keys() and \
+               np.all([_cacheMatches(full[k], sub[k], atoms) for k in full])
+    if isinstance(full, (list, tuple)):
+        try:
+            full, sub = np.asarray(full), np.asarray(sub)
+        except ValueError:
+            return len(full) == len(sub) and np.all([_cacheMatches(f, s, atoms) for f, s in zip(full, sub)])
+        if full.dtype == object:
+            return full.shape == sub.shape and np.all([_cacheMatches(f, s, atoms) for f, s in zip(full, sub)])
+    if not isinstance(full, np.ndarray) or not isinstance(sub, np.ndarray):
+        return type(full) == type(sub) and full == sub
+    if full.shape == sub.shape and np.array_equal(full, sub):
+        return True  # Not atom related (i.e. selections on the reference molecule)
+    if full.dtype == bool and sub.dtype == bool and full.ndim > 0:
+        return full.shape[:-1] == sub.shape[:-1] and np.array_equal(full[..., atoms], sub)
+    if np.issubdtype(full.dtype, np.integer) and np.issubdtype(sub.dtype, np.integer):
+        return full.shape == sub.shape and np.array_equal(atoms[sub], full)
+    return False
+
+
+def _projectMol(mol, projectionlist, sim):
+    data = []
+    for proj in projectionlist:
+        result = _project(proj, mol)
+        if result.ndim == 1:
+            result = np.atleast_2d(result).T
+        if result.size == 0:
+            logger.warning(f'No data was produced by projection {proj.__class__} of simulation id: {sim.simid}')
+        data.append(result)
+
+    data = np.hstack(data)
+    if data.dtype == np.float64:
+        data = data.astype(np.float32)
+    return data
+
+
+def _pieceWindows(sim, chunksize, pieceidx=None):
+    # Groups consecutive trajectory pieces into windows of at most `chunksize` frames. Pieces with an unknown number of
+    # frames or larger than `chunksize` get a window of their own.
+    numframes = sim.numframes
+    if numframes is None:
+        numframes = [None] * len(sim.trajectory)
+    if pieceidx is None:
+        pieceidx = range(len(sim.trajectory))
+
+    windows = []
+    curr = []
+    currframes = 0
+    for i in pieceidx:
+        nf = numframes[i]
+        if nf is None or (len(curr) and currframes + nf > chunksize):
+            if len(curr):
+                windows.append(curr)
+            curr = []
+            currframes = 0
+        curr.append(i)
+        currframes += nf if nf is not None else chunksize
+    if len(curr):
+        windows.append(curr)
+    return windows
+
+
+def _simShards(sim, shardframes):
+    # Splits a simulation into shards of consecutive trajectory pieces of about `shardframes` frames. Returns the piece
+    # indexes of each shard and the number of simulation frames preceding it. Simulations with unknown piece lengths
+    # cannot be sharded as the frame offsets of the shards are needed for frame skipping.
+    if sim.numframes is None or np.any([nf is None for nf in sim.numframes]):
+        return [None]
+    windows = _pieceWindows(sim, shardframes)
+    if len(windows) == 1:
+        return [None]
+    offsets = np.cumsum(np.append(0, sim.numframes))
+    return [(w, int(offsets[w[0]])) for w in windows]
+
+
+def _taskCost(sim, shard):
+    # Number of frames of a projection task. Simulations with unknown lengths are estimated by their number of pieces
+    pieceidx = range(len(sim.trajectory)) if shard is None else shard[0]
+    if sim.numframes is None or np.any([sim.numframes[i] is None for i in pieceidx]):
+        return len(pieceidx)
+    return sum([sim.numframes[i] for i in pieceidx])
+
+
+def _stitchShards(results, tasksim, outfiles=None):
+    # Concatenates in order the results of the shards of each simulation
+    from itertools import groupby
+    stitched = []
+    for i, group in groupby(zip(tasksim, results), key=lambda x: x[0]):
+        simres = [r for _, r in group]
+        if len(simres) == 1:
+            stitched.append(simres[0])
+            continue
+        # Shards of a single frame have no frame step
+        fstep = next((r[2] for r in simres if r[2] is not None), None)
+        if outfiles is None:
+            if np.any([r[3] for r in simres]):
+                stitched.append((None, None, None, True))
+            else:
+                stitched.append((np.concatenate([r[0] for r in simres]), np.concatenate([r[1] for r in simres]),
+                                 fstep, False))
+            continue
+        # Remove the shard files whether the simulation failed or not
+        try:
+            if np.any([r[3] for r in simres]):
+                stitched.append((None, None, None, True))
+            else:
+                stitched.append(_concatShardFiles(outfiles[i], [r[0] for r in simres], [r[1] for r in simres]) +
+                                (fstep, False))
+        finally:
+            for r in simres:
+                for f in r[:2]:
+                    if f is not None and os.path.exists(f):
+                        os.remove(f)
+    return stitched
+
+
+def _concatShardFiles(outfile, projfiles, reffiles):
+    # Concatenates on disk the shard files of a simulation without loading them all in memory
+    outputs = []
+    for files, suffix in ((projfiles, 'projection'), (reffiles, 'reference')):
+        shards = [np.load(f, mmap_mode='r') for f in files]
+        outname = '{}.{}.npy'.format(outfile, suffix)
+        out = np.lib.format.open_memmap(outname, mode='w+', dtype=shards[0].dtype,
+                                        shape=(sum([x.shape[0] for x in shards]),) + shards[0].shape[1:])
+        start = 0
+        for x in shards:
+            out[start:start + x.shape[0]] = x
+            start += x.shape[0]
+        out.flush()
+        del out, shards
+        outputs.append(outname)
+    return tuple(outputs)
+
+
+def _projectShard(mol, frames, projectionlist):
+    mol = mol.copy(frames=frames)
+    return [_project(proj, mol) for proj in projectionlist]
+
+
+def _projectionHash(projectionlist):
+    # Projections store atom selections computed by _setCache. Exclude them so the hash does not depend on whether the
+    # projection objects have already been used on a topology.
+    import hashlib
+    import pickle
+    h = hashlib.sha1()
+    for proj in projectionlist:
+        if isinstance(proj, Projection):
+            state = {k: v for k, v in proj.__dict__.items() if k != '_cache'}
+            h.update('{}.{}'.format(proj.__class__.__module__, proj.__class__.__qualname__).encode())
+            h.update(pickle.dumps(sorted(state.items(), key=lambda x: x[0])))
+        else:
+            try:
+                h.update(pickle.dumps(proj))
+            except Exception:  # Unpicklable functions (i.e. lambdas). Fall back to their names
+                h.update(repr(proj).encode())
+    return h.hexdigest()
+
+
+def _cacheKey(sim, skip, projhash, shard=None):
+    import hashlib
+    from htmd.util import ensurelist
+    pieces = list(sim.trajectory)
+    if shard is not None:
+        pieces = [pieces[i] for i in shard[0]]
+    h = hashlib.sha1()
+    for f in pieces + ensurelist(sim.molfile):
+        st = os.stat(f)
+        h.update('{}:{}:{};'.format(os.path.abspath(f), st.st_size, st.st_mtime_ns).encode())
+    h.update('skip:{};proj:{}'.format(skip, projhash).encode())
+    if shard is not None:
+        h.update('offset:{}'.format(shard[1]).encode())
+    return h.hexdigest()
+
+
+def _loadCached(cachefile):
+    with np.load(cachefile) as f:
+        return f['data'], f['ref'], float(f['fstep']), False
+
+
+def _saveCached(cachefile, data, ref, fstep):
+    # Write to a temporary file and rename it to avoid other processes reading partially written cache files
+    tmpfile = '{}.{}.tmp.npz'.format(cachefile[:-4], os.getpid())
+    try:
+        np.savez(tmpfile, data=data, ref=ref, fstep=fstep)
+        os.replace(tmpfile, cachefile)
+    except OSError as e:
+        logger.warning(f'Could not write projection cache file {cachefile}. "{e}"')
 
 
 def _calcRef(pieces, fileloc):
@@ -346,6 +725,185 @@ class _TestMetric(unittest.TestCase):
         metr.set((foo, (ref,)))
         assert len(metr.projectionlist) == 1
 
+    @staticmethod
+    def _adaptiveSims():
+        from htmd.simlist import simlist
+        from htmd.home import home
+        from glob import glob
+        from os.path import join
+        return simlist(glob(join(home(dataDir='adaptive'), 'data', '*', '')), glob(join(home(dataDir='adaptive'), 'input', '*')))
+
+    def _assertSameData(self, data1, data2, atol=0):
+        assert data1.numTrajectories == data2.numTrajectories
+        for t1, t2 in zip(data1.trajectories, data2.trajectories):
+            assert np.allclose(t1.projection, t2.projection, rtol=0, atol=atol)
+            assert np.array_equal(t1.reference, t2.reference)
+
+    def test_projection_cache(self):
+        from moleculekit.projections.metricdistance import MetricDistance
+        from moleculekit.util import tempname
+        from glob import glob
+        from os.path import join
+
+        sims = self._adaptiveSims()
+        cache = tempname()
+        metr = Metric(sims)
+        metr.set(MetricDistance('protein and resid 10 and name CA', 'resname BEN and noh', metric='contacts'))
+        data1 = metr.project(cache=cache)
+        cachefiles = glob(join(cache, '*.npz'))
+        assert len(cachefiles) == len(sims)
+
+        # Mark the cached projections to check that the second call reads them instead of projecting again
+        for f in cachefiles:
+            data, ref, fstep, _ = _loadCached(f)
+            _saveCached(f, data + 2, ref, fstep)
+        data2 = metr.project(cache=cache)
+        assert len(glob(join(cache, '*.npz'))) == len(sims)
+        for t1, t2 in zip(data1.trajectories, data2.trajectories):
+            assert np.array_equal(t1.projection + 2, t2.projection)
+            assert np.array_equal(t1.reference, t2.reference)
+        assert data2.fstep == data1.fstep
+
+        # Changing the projection must not reuse the cached results
+        metr.set(MetricDistance('protein and resid 10 and name CA', 'resname BEN and noh', metric='distances'))
+        metr.project(cache=cache)
+        assert len(glob(join(cache, '*.npz'))) == 2 * len(sims)
+
+    def test_streaming_projection(self):
+        from moleculekit.projections.metricdistance import MetricDistance
+
+        sims = self._adaptiveSims()
+        for chunksize in (1, 10, 1000):
+            for sim in sims:
+                windows = _pieceWindows(sim, chunksize)
+                assert np.array_equal(np.concatenate(windows), np.arange(len(sim.trajectory)))
+                for w in windows:
+                    assert len(w) == 1 or np.sum(np.array(sim.numframes)[w]) <= chunksize
+
+        # Frame skipping is global over the simulation and must not restart at window boundaries
+        for skip in (1, 4):
+            metr = Metric(sims, skip=skip)
+            metr.set(MetricDistance('protein and resid 10 and name CA', 'resname BEN and noh', metric='distances'))
+            data1 = metr.project()
+            data2 = metr.project(chunksize=1)
+            self._assertSameData(data1, data2)
+            assert data2.fstep == data1.fstep
+
+    def test_streaming_single_frame_window(self):
+        from htmd.simlist import simlist
+        from moleculekit.projections.metricdistance import MetricDistance
+        from moleculekit.util import tempname
+        from os.path import join
+
+        # A simulation whose last window holds a single frame, from which no frame step can be read
+        sim = self._adaptiveSims()[0]
+        folder = tempname()
+        os.makedirs(join(folder, 'data', 'sim'))
+        mol = Molecule(sim.molfile)
+        mol.read(sim.trajectory[0])
+        fstep = mol.fstep
+        mol.write(join(folder, 'data', 'sim', 'traj1.xtc'))
+        mol.dropFrames(keep=0)
+        mol.write(join(folder, 'data', 'sim', 'traj2.xtc'))
+        sims = simlist([join(folder, 'data', 'sim', '')], sim.molfile)
+
+        metr = Metric(sims)
+        metr.set(MetricDistance('protein and resid 10 and name CA', 'resname BEN and noh', metric='distances'))
+        data = metr.project(chunksize=1)
+        assert data.trajectories[0].projection.shape[0] == sim.numframes[0] + 1
+        assert np.isclose(data.fstep, fstep)
+
+    def test_atomsubset_projection(self):
+        from moleculekit.projections.metricdistance import MetricDistance, MetricSelfDistance
+        from moleculekit.projections.metricrmsd import MetricRmsd
+
+        sims = self._adaptiveSims()
+        ref = Molecule(sims[0].molfile)
+        metr = Metric(sims)
+        metr.set([MetricDistance('resid 10 and name CA', 'resname BEN and noh', metric='distances'),
+                  MetricSelfDistance('name CA', metric='contacts'),
+                  MetricRmsd(ref, 'name CA', centerstr='name CA')])
+        for proj in metr.projectionlist:
+            proj._setCache(ref)
+        atoms, _ = _atomSubset(metr.projectionlist, ref)
+        assert np.array_equal(atoms, np.where(ref.atomselect('name CA or (resname BEN and noh)'))[0])
+
+        data1 = metr.project()
+        data2 = metr.project(atomsubset=True)
+        self._assertSameData(data1, data2, atol=1e-4)
+
+        # Selections which cannot be evaluated on the subset fall back to reading all atoms
+        proj = MetricSelfDistance('protein and name CA')
+        proj._setCache(ref)
+        atoms, projectionlist = _atomSubset([proj], ref)
+        assert atoms is None and projectionlist[0] is proj
+
+    def test_projection_outdir(self):
+        from moleculekit.projections.metricdistance import MetricDistance
+        from moleculekit.util import tempname
+        from glob import glob
+        from os.path import join
+
+        sims = self._adaptiveSims()
+        outdir = tempname()
+        metr = Metric(sims)
+        metr.set(MetricDistance('protein and resid 10 and name CA', 'resname BEN and noh', metric='distances'))
+        data1 = metr.project()
+        data2 = metr.project(njobs=2, outdir=outdir)
+        assert len(glob(join(outdir, '*.projection.npy'))) == len(sims)
+        for t in data2.trajectories:
+            assert isinstance(t.projection, np.memmap)
+        self._assertSameData(data1, data2)
+
+    def test_failed_shard_files(self):
+        from moleculekit.util import tempname
+        from glob import glob
+        from os.path import join
+
+        outdir = tempname()
+        os.makedirs(outdir)
+        outfiles = [join(outdir, 'sim0'), join(outdir, 'sim1')]
+        data = np.arange(12, dtype=np.float32).reshape(6, 2)
+        ref = np.arange(12).reshape(6, 2)
+        results = [_saveShard('{}.shard{}'.format(outfiles[i], j), data[j:j + 3], ref[j:j + 3]) + (0.1, False)
+                   for i, j in ((0, 0), (0, 3), (1, 0))]
+        # The second shard of the second simulation failed to project
+        results.append((None, None, None, True))
+
+        stitched = _stitchShards(results, [0, 0, 1, 1], outfiles)
+        assert np.array_equal(np.load(stitched[0][0]), data) and np.array_equal(np.load(stitched[0][1]), ref)
+        assert stitched[0][2] == 0.1 and not stitched[0][3]
+        assert stitched[1] == (None, None, None, True)
+        assert sorted(glob(join(outdir, '*'))) == sorted([stitched[0][0], stitched[0][1]])
+
+    def test_sharded_projection(self):
+        from htmd.simlist import simlist
+        from htmd.home import home
+        from moleculekit.projections.metricdistance import MetricSelfDistance
+        from glob import glob
+        from os.path import join
+
+        testfolder = home(dataDir='villin')
+        sims = simlist(glob(join(testfolder, '*', '')), join(testfolder, 'filtered.pdb'))[0:2]
+        mol = Molecule(join(testfolder, 'filtered.pdb'))
+        mol.read(sims[0].trajectory)
+
+        metr = Metric(mol)
+        metr.set(MetricSelfDistance('protein and name CA'))
+        data1 = metr.project()
+        data2 = metr.project(njobs=2, shardframes=int(mol.numFrames / 3))
+        assert np.array_equal(data1[0], data2[0])
+
+        # Each shard starts at a trajectory piece and the shards cover all pieces in order
+        shards = _simShards(sims[0], 1)
+        assert np.array_equal(np.concatenate([s[0] for s in shards]), np.arange(len(sims[0].trajectory)))
+        assert np.array_equal([s[1] for s in shards], np.append(0, np.cumsum(sims[0].numframes)[:-1]))
+
+        metr = Metric(sims, skip=3)
+        metr.set(MetricSelfDistance('protein and name CA'))
+        data1 = metr.project()
+        data2 = metr.project(njobs=2, shardframes=1)
+        self._assertSameData(data1, data2)
 
 if __name__ == '__main__':
     unittest.main(verbosity=2)
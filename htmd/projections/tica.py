@@ -13,6 +13,63 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+_SPILLLIMIT = 10 * 1024 ** 3  # Default maximum size in bytes of the projections stored by _SpillStore
+
+
+class _SpillStore(object):
+    """ Temporary on-disk store of the projected trajectories of a Metric, memory-mapped on reading
+
+    If `limit` is None it stores at most _SPILLLIMIT bytes and no more than half of the free space of the disk.
+    """
+    def __init__(self, spilldir=None, limit=None):
+        import tempfile
+        import shutil
+        import weakref
+        self.size = 0
+        self.entries = {}
+        self.dir = None
+        self.limit = limit
+        if limit != 0:
+            self.dir = tempfile.mkdtemp(prefix='htmd_tica_', dir=spilldir)
+            weakref.finalize(self, shutil.rmtree, self.dir, ignore_errors=True)
+            if limit is None:
+                self.limit = min(_SPILLLIMIT, shutil.disk_usage(self.dir).free // 2)
+
+    def put(self, i, pro):
+        import os
+        if self.dir is None:
+            return False
+        if pro is None or pro[0] is None:
+            self.entries[i] = None
+            return True
+        nbytes = pro[0].nbytes + pro[1].nbytes
+        if self.size + nbytes > self.limit:
+            return False
+        datafile = os.path.join(self.dir, '{}.projection.npy'.format(i))
+        reffile = os.path.join(self.dir, '{}.reference.npy'.format(i))
+        np.save(datafile, pro[0])
+        np.save(reffile, pro[1])
+        self.size += nbytes
+        self.entries[i] = (datafile, reffile, pro[2])
+        return True
+
+    def get(self, i):
+        entry = self.entries[i]
+        if entry is None:
+            return None
+        return np.load(entry[0], mmap_mode='r'), np.load(entry[1]), entry[2]
+
+    def generator(self, metric, njobs):
+        """ Same output as _projectionGenerator, reading the stored trajectories and projecting only the rest """
+        from htmd.projections.metric import _projector
+        numsims = len(metric.simulations)
+        for i in range(0, numsims, njobs):
+            simrange = range(i, min(i + njobs, numsims))
+            missing = [j for j in simrange if j not in self.entries]
+            results = dict(zip(missing, Parallel(n_jobs=njobs, verbose=0)(delayed(_projector)(metric, j) for j in missing)))
+            yield [self.get(j) if j in self.entries else results[j] for j in simrange]
+
+
 class TICA(object):
     """ Class for calculating the TICA projections of a MetricData  object
 
@@ -33,6 +90,22 @@ class TICA(object):
         If None is given, it will apply on all dimensions.
     njobs : int
         Number of jobs to spawn for parallel computation of TICA components. If None it will use the default from htmd.config.
+    spilldir : str
+        When passing a Metric object, the trajectories projected for fitting TICA are stored in a temporary directory
+        inside `spilldir` and memory-mapped again by `project` instead of being re-projected. If None it will use the
+        system temporary directory.
+    spilllimit : int
+        Maximum size in bytes of the stored projections. Trajectories which do not fit are re-projected by `project`.
+        Set to 0 to disable storing projections. If None it will store up to 10 GB and no more than half of the free
+        disk space of `spilldir`.
+    backend : ('pyemma', 'native'), str
+        The pyemma backend fits with pyemma serially. The native backend computes the covariances of the trajectories
+        in parallel with `njobs` threads and merges them exactly. Its `tic` object provides the eigenvalues,
+        eigenvectors, timescales and `transform` of the pyemma one, but not the rest of the pyemma estimator API.
+    covfile : str
+        Only for the native backend. File in which the covariance sums of the trajectories are stored. If the file
+        exists, trajectories whose sums it already contains are not recomputed, so that refitting TICA after adding
+        new trajectories (i.e. in adaptive runs) only processes the new ones. The file is updated with the new sums.
 
     Example
     -------
@@ -56,44 +129,123 @@ class TICA(object):
     for Markov model construction. J. Chem. Phys., 139 . 015102.
     """
 
-    def __init__(self, data, lag, units='frames', dimensions=None, njobs=None):
-        from pyemma.coordinates.transform.tica import TICA as TICApyemma
+    def __init__(self, data, lag, units='frames', dimensions=None, njobs=None, spilldir=None, spilllimit=None,
+                 backend='pyemma', covfile=None):
         from tqdm import tqdm
-        from htmd.util import _getNjobs
 
-        self.data = data
-        self.dimensions = dimensions
-        self.njobs = njobs if njobs is not None else _getNjobs()
+        if backend not in ('native', 'pyemma'):
+            raise ValueError('backend must be either \'native\' or \'pyemma\'')
+        if covfile is not None and backend != 'native':
+            raise ValueError('covfile can only be used with the native backend')
+
+        self._setup(data, dimensions, njobs)
 
         if isinstance(data, Metric):  # Memory efficient TICA projecting trajectories on the fly
             if units != 'frames':
                 raise RuntimeError('Cannot use delayed projection TICA with units other than frames for now. Report this to HTMD issues.')
-            self.tic = TICApyemma(lag)
             metr = data
+            self._spill = _SpillStore(spilldir, spilllimit)
+            if backend == 'native':
+                self.covariances = _CovarianceSums.cached(covfile, [lag], self._fingerprint(), self._trajectoryFiles())
+            else:
+                from pyemma.coordinates.transform.tica import TICA as TICApyemma
+                self.tic = TICApyemma(lag)
 
             pbar = tqdm(total=len(metr.simulations))
+            k = 0
             for proj in _projectionGenerator(metr, self.njobs):
+                arrays = []
+                keys = []
                 for pro in proj:
+                    self._spill.put(k, pro)
+                    sim = metr.simulations[k]
+                    k += 1
                     if pro is None:
                         continue
-                    if self.dimensions is None:
-                        self.tic.partial_fit(pro[0])
-                    else:  # Sub-select dimensions for fitting
-                        self.tic.partial_fit(pro[0][:, self.dimensions])
+                    x = pro[0] if self.dimensions is None else pro[0][:, self.dimensions]  # Sub-select dimensions for fitting
+                    if backend == 'native':
+                        arrays.append(x)
+                        keys.append(_trajectoryKey(sim, x.shape[0]))
+                    else:
+                        self.tic.partial_fit(x)
+                if backend == 'native':
+                    self.covariances.addTrajectories(arrays, keys, njobs=self.njobs)
                 pbar.update(len(proj))
             pbar.close()
-        else:  # In-memory TICA
-            lag = unitconvert(units, 'frames', lag, data.fstep)
-            if lag == 0:
-                raise RuntimeError('Lag time conversion resulted in 0 frames. Please use a larger lag-time for TICA.')
-
+            if backend == 'native':
+                self._finalizeNative(lag, covfile)
+            return
+
+        # In-memory TICA
+        lag = unitconvert(units, 'frames', lag, data.fstep)
+        if lag == 0:
+            raise RuntimeError('Lag time conversion resulted in 0 frames. Please use a larger lag-time for TICA.')
+
+        if backend == 'native':
+            self.covariances = _CovarianceSums.cached(covfile, [lag], self._fingerprint(), self._trajectoryFiles())
+            keys = [_trajectoryKey(t.sim, t.numFrames) for t in data.trajectories]
+            self.covariances.addTrajectories(data.trajectories, keys, njobs=self.njobs, dimensions=self.dimensions)
+            self._finalizeNative(lag, covfile)
+        else:
+            from pyemma.coordinates.transform.tica import TICA as TICApyemma
             self.tic = TICApyemma(lag)
+            if data._isLazy():  # Out-of-core data. Fit one trajectory at a time
+                for t in tqdm(data.trajectories, desc='Fitting TICA'):
+                    if t.numFrames <= lag:
+                        continue
+                    if self.dimensions is None:
+                        self.tic.partial_fit(t.projection)
+                    else:
+                        self.tic.partial_fit(t.projection[:, self.dimensions])
+                return
             if self.dimensions is None:
                 datalist = data.dat.tolist()
             else:  # Sub-select dimensions for fitting
                 datalist = [x[:, self.dimensions].copy() for x in data.dat]
             self.tic.fit(datalist)
 
+    @classmethod
+    def _fromCovariances(cls, data, covariances, lag, dimensions=None, njobs=None, spill=None):
+        """ Creates the TICA object of lag time `lag` in frames from precomputed :class:`_CovarianceSums` of `data`
+
+        Parameters
+        ----------
+        spill : :class:`_SpillStore`
+            For Metric data, the store of its projected trajectories. If None they are re-projected by `project`.
+        """
+        tica = cls.__new__(cls)
+        tica._setup(data, dimensions, njobs)
+        if isinstance(data, Metric):
+            tica._spill = spill if spill is not None else _SpillStore(limit=0)
+        tica.covariances = covariances
+        tica._finalizeNative(lag, None)
+        return tica
+
+    def _setup(self, data, dimensions, njobs):
+        from htmd.util import _getNjobs
+        self.data = data
+        self.dimensions = dimensions
+        self.njobs = njobs if njobs is not None else _getNjobs()
+
+    def _fingerprint(self):
+        """ Identifies the input space of the covariances stored in a covfile """
+        dims = None if self.dimensions is None else tuple(int(d) for d in self.dimensions)
+        if isinstance(self.data, Metric):
+            return dims, _metricFingerprint(self.data)
+        desc = None
+        if self.data.description is not None:
+            desc = tuple(self.data.description['description'])
+        return dims, desc
+
+    def _trajectoryFiles(self):
+        sims = self.data.simulations if isinstance(self.data, Metric) else [t.sim for t in self.data.trajectories]
+        return set(k[0] for k in (_trajectoryKey(sim, 0) for sim in sims) if k is not None)
+
+    def _finalizeNative(self, lag, covfile):
+        self.tic = _NativeTICA(lag, *self.covariances.covariances(lag))
+        if covfile is not None:
+            self.covariances.save(covfile)
+
     def project(self, ndim=None):
         """ Projects the data object given to the constructor onto the top `ndim` TICA dimensions
 
@@ -130,7 +282,7 @@ class TICA(object):
             k = -1
             droppedsims = []
             pbar = tqdm(total=len(metr.simulations))
-            for projecteddata in _projectionGenerator(metr, self.njobs):
+            for projecteddata in self._spill.generator(metr, self.njobs):
                 for pro in projecteddata:
                     k += 1
                     if pro is None:
@@ -166,10 +318,16 @@ class TICA(object):
 
             if self.dimensions is not None:
                 keepdim = np.setdiff1d(range(self.data.numDimensions), self.dimensions)
-                keepdata = [x[:, keepdim] for x in self.data.dat]
+                keepdata = [t.projection[:, keepdim] for t in self.data.trajectories]
                 if self.data.description is not None:
                     keepdimdesc = self.data.description.iloc[keepdim]
-            proj = self.tic.get_output()
+            if self.data._isLazy() or isinstance(self.tic, _NativeTICA):  # Transform one trajectory at a time
+                proj = []
+                for t in tqdm(self.data.trajectories, desc='Projecting TICA'):
+                    pro = t.projection if self.dimensions is None else t.projection[:, self.dimensions]
+                    proj.append(self.tic.transform(pro).astype(np.float32))
+            else:
+                proj = self.tic.get_output()
             simlist = self.data.simlist
             ref = self.data.ref
             fstep = self.data.fstep
@@ -187,7 +345,7 @@ class TICA(object):
             logger.info('Kept {} dimension(s) to cover 95% of kinetic variance.'.format(ndim))
 
         from htmd.metricdata import MetricData
-        datatica = MetricData(dat=np.array(proj), simlist=simlist, ref=ref, fstep=fstep, parent=parent)
+        datatica = MetricData(dat=list(proj), simlist=simlist, ref=ref, fstep=fstep, parent=parent)
         from pandas import DataFrame
         # TODO: Make this messy pandas creation cleaner. I'm sure I can append rows to DataFrame
         types = []
@@ -205,6 +363,299 @@ class TICA(object):
         return datatica
 
 
+def ticaLagScan(data, lags, units='frames', dimensions=None, njobs=None, spilldir=None, spilllimit=None):
+    """ Calculates TICA for several lag times with a single pass over the data
+
+    The instantaneous and time-lagged covariances of all lag times are accumulated together, so scanning many lag
+    times costs about as much as a single TICA. The covariances are estimated assuming reversibility as done by
+    :class:`TICA`.
+
+    Parameters
+    ----------
+    data : :class:`MetricData <htmd.metricdata.MetricData>` object or :class:`Metric <htmd.projections.metric.Metric>` object
+        The data on which to calculate TICA. If a Metric is passed, the trajectories are projected only once and stored
+        for projecting the resulting TICA objects (see the `spilldir` and `spilllimit` arguments of :class:`TICA`).
+    lags : list
+        The lag times to calculate
+    units : str
+        The units of lags. Can be 'frames' or any time unit given as a string.
+    dimensions : list
+        A list of dimensions of the original data on which to apply TICA. All other dimensions will stay unaltered.
+    njobs : int
+        Number of jobs to spawn for projecting a Metric object. If None it will use the default from htmd.config.
+    spilldir : str
+        Directory in which to store the projected trajectories of a Metric object
+    spilllimit : int
+        Maximum size in bytes of the stored projected trajectories of a Metric object. If None it will store up to 10 GB
+        and no more than half of the free disk space of `spilldir`.
+
+    Returns
+    -------
+    ticas : list of :class:`TICA` objects
+        One TICA object per lag time. The eigenvalues and implied timescales of each are in `tica.tic.eigenvalues` and
+        `tica.tic.timescales`.
+
+    Example
+    -------
+    >>> ticas = ticaLagScan(data, [5, 10, 20, 50])
+    >>> for t in ticas:
+    ...     print(t.tic.lag, t.tic.timescales[:3])
+    >>> datatica = ticas[2].project(3)
+    """
+    from tqdm import tqdm
+    from htmd.util import _getNjobs
+    njobs = njobs if njobs is not None else _getNjobs()
+
+    spill = None
+    if isinstance(data, Metric):
+        if units != 'frames':
+            raise RuntimeError('Cannot use delayed projection TICA with units other than frames for now. Report this to HTMD issues.')
+        framelags = [int(l) for l in lags]
+    else:
+        framelags = [int(unitconvert(units, 'frames', l, data.fstep)) for l in lags]
+    if np.any(np.array(framelags) <= 0):
+        raise RuntimeError('Lag time conversion resulted in 0 frames. Please use larger lag-times for TICA.')
+
+    sums = _CovarianceSums(framelags)
+    if isinstance(data, Metric):
+        spill = _SpillStore(spilldir, spilllimit)
+        pbar = tqdm(total=len(data.simulations))
+        k = 0
+        for proj in _projectionGenerator(data, njobs):
+            arrays = []
+            for pro in proj:
+                spill.put(k, pro)
+                k += 1
+                if pro is not None and pro[0] is not None:
+                    arrays.append(pro[0] if dimensions is None else pro[0][:, dimensions])
+            sums.addTrajectories(arrays, njobs=njobs)
+            pbar.update(len(proj))
+        pbar.close()
+    else:
+        sums.addTrajectories(data.trajectories, njobs=njobs, dimensions=dimensions)
+
+    return [TICA._fromCovariances(data, sums, lag, dimensions=dimensions, njobs=njobs, spill=spill) for lag in framelags]
+
+
+class _LaggedMoments(object):
+    """ Number, means and centered (co)scatter matrices of the frame pairs (x_t, x_t+lag) of a set of trajectories
+
+    Moments of different sets are combined exactly with the pairwise update of Chan et al.
+    """
+    def __init__(self, x0=None, xt=None, ndim=0):
+        if x0 is None:
+            self.n = 0
+            self.m0 = np.zeros(ndim)
+            self.mt = np.zeros(ndim)
+            self.s00 = np.zeros((ndim, ndim))
+            self.s0t = np.zeros((ndim, ndim))
+            self.stt = np.zeros((ndim, ndim))
+            return
+        self.n = x0.shape[0]
+        self.m0 = x0.mean(axis=0)
+        self.mt = xt.mean(axis=0)
+        x0 = x0 - self.m0
+        xt = xt - self.mt
+        self.s00 = x0.T.dot(x0)
+        self.s0t = x0.T.dot(xt)
+        self.stt = xt.T.dot(xt)
+
+    def merge(self, other):
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.__dict__.update({k: np.copy(v) for k, v in other.__dict__.items()})
+            return self
+        n = self.n + other.n
+        d0 = other.m0 - self.m0
+        dt = other.mt - self.mt
+        f = self.n * other.n / n
+        self.s00 += other.s00 + f * np.outer(d0, d0)
+        self.s0t += other.s0t + f * np.outer(d0, dt)
+        self.stt += other.stt + f * np.outer(dt, dt)
+        self.m0 += d0 * other.n / n
+        self.mt += dt * other.n / n
+        self.n = n
+        return self
+
+    def covariances(self):
+        """ Mean, instantaneous and time-lagged covariance matrices estimated symmetrically over both time directions """
+        n = self.n
+        mean = (self.m0 + self.mt) / 2
+        d0 = self.m0 - mean
+        dt = self.mt - mean
+        cov = (self.s00 + self.stt + n * (np.outer(d0, d0) + np.outer(dt, dt))) / (2 * n)
+        a = self.s0t + n * np.outer(d0, dt)
+        cov_tau = (a + a.T) / (2 * n)
+        return mean, cov, cov_tau
+
+
+def _trajectoryKey(sim, numframes):
+    """ Identifies the contribution of a trajectory to the covariance sums across TICA runs """
+    if sim is None or getattr(sim, 'trajectory', None) is None:
+        return None
+    return tuple(str(f) for f in np.atleast_1d(sim.trajectory)), int(numframes)
+
+
+def _metricFingerprint(metric):
+    """ Hash of the projections, skip and structures of a Metric, which define the space of its projected data """
+    import hashlib
+    from htmd.projections.metric import _projectionHash
+    molfiles = sorted(set(str(sim.molfile) for sim in metric.simulations))
+    desc = repr((metric.skip, _projectionHash(metric.projectionlist), molfiles))
+    return hashlib.md5(desc.encode()).hexdigest()
+
+
+def _trajectoryMoments(x, lags, dimensions=None):
+    if hasattr(x, 'projection'):  # Trajectory objects are resolved inside the worker to load lazy data in parallel
+        x = x.projection
+    if dimensions is not None:
+        x = x[:, dimensions]
+    x = np.asarray(x, dtype=np.float64)
+    return {lag: _LaggedMoments(x[:-lag], x[lag:]) for lag in lags if x.shape[0] > lag}
+
+
+class _CovarianceSums(object):
+    """ Accumulates :class:`_LaggedMoments` of several lag times
+
+    The keys of the trajectories whose contributions are included are kept so that the sums can be stored and
+    updated only with new trajectories.
+    """
+    def __init__(self, lags, fingerprint=None):
+        self.lags = list(lags)
+        self.moments = {lag: None for lag in self.lags}
+        self.fingerprint = fingerprint
+        self.trajkeys = set()
+
+    @staticmethod
+    def cached(covfile, lags, fingerprint, trajfiles):
+        """ Loads the sums stored in covfile if they are compatible, otherwise returns empty sums
+
+        The stored sums are rejected if they were computed on a different input space or lag time, or if they contain
+        trajectories which are not among the files `trajfiles` of the current data.
+        """
+        import os
+        if covfile is not None and os.path.exists(covfile):
+            sums = _CovarianceSums.load(covfile)
+            if sums.fingerprint != fingerprint or not set(lags) <= set(sums.lags):
+                logger.warning('The TICA covariances in {} were computed with different parameters and will be recomputed'.format(covfile))
+            elif not set(k[0] for k in sums.trajkeys) <= trajfiles:
+                logger.warning('The TICA covariances in {} contain trajectories which are not in the data and will be recomputed'.format(covfile))
+            else:
+                logger.info('Loaded the TICA covariances of {} trajectories from {}'.format(len(sums.trajkeys), covfile))
+                return sums
+        return _CovarianceSums(lags, fingerprint)
+
+    def add(self, x, trajkey=None):
+        if trajkey is not None:
+            if trajkey in self.trajkeys:
+                return
+            self.trajkeys.add(trajkey)
+        self._merge(_trajectoryMoments(x, self.lags))
+
+    def addTrajectories(self, trajs, trajkeys=None, njobs=1, dimensions=None):
+        """ Adds the contributions of several trajectories computed in parallel threads
+
+        Trajectories can be given as arrays or as :class:`Trajectory <htmd.metricdata.Trajectory>` objects.
+        Trajectories whose keys were already added are skipped.
+        """
+        if trajkeys is None:
+            trajkeys = [None] * len(trajs)
+        new = [i for i, k in enumerate(trajkeys) if k is None or k not in self.trajkeys]
+        if len(new) == 0:
+            return
+        from tqdm import tqdm
+        # Trajectories are processed in batches of a few per job and their moments folded into the sums after each
+        # batch, so that only the moments of the trajectories of one batch are held in memory
+        batchsize = 2 * max(1, njobs)
+        with Parallel(n_jobs=njobs, backend='threading') as parallel, tqdm(total=len(new), desc='Computing covariances') as pbar:
+            for b in range(0, len(new), batchsize):
+                batch = new[b:b + batchsize]
+                for moments in parallel(delayed(_trajectoryMoments)(trajs[i], self.lags, dimensions) for i in batch):
+                    self._merge(moments)
+                pbar.update(len(batch))
+        self.trajkeys.update(trajkeys[i] for i in new if trajkeys[i] is not None)
+
+    def merge(self, other):
+        """ Adds the contributions of other sums over the same lag times and input space """
+        if other.lags != self.lags or other.fingerprint != self.fingerprint:
+            raise ValueError('Cannot merge covariance sums of different lag times or input spaces')
+        if len(self.trajkeys & other.trajkeys):
+            raise ValueError('Cannot merge covariance sums containing the same trajectories')
+        self._merge(other.moments)
+        self.trajkeys |= other.trajkeys
+        return self
+
+    def _merge(self, moments):
+        for lag in self.lags:
+            if moments.get(lag) is None:
+                continue
+            if self.moments[lag] is None:
+                self.moments[lag] = _LaggedMoments(ndim=moments[lag].m0.shape[0])
+            self.moments[lag].merge(moments[lag])
+
+    def covariances(self, lag):
+        if self.moments[lag] is None:
+            raise RuntimeError('No trajectory is longer than the lag time {}.'.format(lag))
+        return self.moments[lag].covariances()
+
+    def save(self, filename):
+        import pickle
+        with open(filename, 'wb') as f:
+            pickle.dump(self.__dict__, f)
+
+    @staticmethod
+    def load(filename):
+        import pickle
+        sums = _CovarianceSums([])
+        with open(filename, 'rb') as f:
+            sums.__dict__.update(pickle.load(f))
+        return sums
+
+
+class _NativeTICA(object):
+    """ TICA solution of given covariance matrices with the interface of the pyemma TICA used by :class:`TICA`.
+
+    Dimensions with instantaneous variance below `epsilon` times the largest one are discarded. The output is scaled
+    by the eigenvalues (kinetic map) like the pyemma default.
+    """
+    def __init__(self, lag, mean, cov, cov_tau, dim=-1, var_cutoff=0.95, epsilon=1e-6):
+        from scipy.linalg import eigh
+        self.lag = lag
+        self.mean = mean
+        self.cov = cov
+        self.cov_tau = cov_tau
+        self.dim = dim
+        self.var_cutoff = var_cutoff
+
+        # Whiten with the instantaneous covariance and diagonalize the time-lagged one in the whitened space
+        s, u = eigh(cov)
+        keep = s > epsilon * np.max(np.abs(s))
+        whiten = u[:, keep] / np.sqrt(s[keep])
+        evals, evecs = eigh(whiten.T.dot(cov_tau).dot(whiten))
+        order = np.argsort(evals)[::-1]
+        self.eigenvalues = evals[order]
+        self.eigenvectors = whiten.dot(evecs[:, order])
+
+    @property
+    def timescales(self):
+        return -self.lag / np.log(np.abs(self.eigenvalues))
+
+    def set_params(self, dim=None):
+        if dim is not None:
+            self.dim = dim
+
+    def dimension(self):
+        if self.dim is not None and self.dim > 0:
+            return min(self.dim, len(self.eigenvalues))
+        kinvar = np.cumsum(self.eigenvalues ** 2) / np.sum(self.eigenvalues ** 2)
+        return min(int(np.searchsorted(kinvar, self.var_cutoff)) + 1, len(self.eigenvalues))
+
+    def transform(self, x):
+        ndim = self.dimension()
+        return (np.asarray(x) - self.mean).dot(self.eigenvectors[:, :ndim]) * self.eigenvalues[:ndim]
+
+
 if __name__ == '__main__':
     from htmd.simlist import simlist
     from glob import glob
@@ -257,4 +708,57 @@ if __name__ == '__main__':
     assert np.all(datatica4.description.iloc[[0, 1]].type == 'tica')
     print('Streaming TICA passed test.')
 
+    tica7 = TICA(met, 2, spilllimit=0)  # Re-project trajectories instead of reading the stored projections
+    datatica7 = tica7.project(2)
+    assert len(tica4._spill.entries) == 2 and len(tica7._spill.entries) == 0
+    assert np.allclose(np.abs(datatica7.trajectories[0].projection), np.abs(datatica4.trajectories[0].projection), atol=0.01)
+    print('Streaming TICA without stored projections passed test.')
+
     assert np.max(np.abs(datatica4.trajectories[0].projection) - np.abs(datatica3.trajectories[0].projection)) < 0.01, 'Streaming and memory TICA inconsistent.'
+
+    from moleculekit.util import tempname
+    from htmd.metricdata import MetricData
+    savedir = tempname()
+    data.save(savedir, format='directory')
+    lazydata = MetricData()
+    lazydata.load(savedir, lazy=True, cachesize=1)
+    tica6 = TICA(lazydata, 2)
+    datatica6 = tica6.project(2)
+    assert np.allclose(np.abs(datatica6.trajectories[0].projection[-3:, :]), np.abs(np.array(expected, dtype=np.float32)), rtol=0, atol=0.01)
+    print('Lazy TICA passed test.')
+
+    ticas = ticaLagScan(data, [2, 4])
+    assert np.allclose(ticas[0].tic.eigenvalues[:3], tica3.tic.eigenvalues[:3], atol=1e-3)
+    assert np.allclose(ticas[1].tic.eigenvalues[:3], TICA(data, 4).tic.eigenvalues[:3], atol=1e-3)
+    datatica8 = ticas[0].project(2)
+    assert np.allclose(np.abs(datatica8.trajectories[0].projection[-3:, :]), np.abs(np.array(expected, dtype=np.float32)), rtol=0, atol=0.01)
+    assert np.allclose(ticaLagScan(met, [2])[0].tic.eigenvalues[:3], tica3.tic.eigenvalues[:3], atol=1e-3)
+    print('Multi-lag TICA passed test.')
+
+    ticanative = TICA(data, 2, backend='native')
+    assert np.allclose(ticanative.tic.eigenvalues[:3], tica3.tic.eigenvalues[:3], atol=1e-3)
+    assert np.allclose(np.abs(ticanative.project(2).trajectories[1].projection), np.abs(tica3.project(2).trajectories[1].projection), rtol=0, atol=0.01)
+
+    # Toy dataset of two slowly exchanging dimensions mixed with noise
+    rng = np.random.RandomState(0)
+    toytrajs = []
+    for _ in range(4):
+        slow = np.cumsum(rng.randn(2000, 2) * 0.05, axis=0) % 2 - 1
+        toytrajs.append(np.hstack([slow, rng.randn(2000, 3)]).dot(rng.rand(5, 5)).astype(np.float32))
+    toydata = MetricData(dat=toytrajs, fstep=0.1)
+    toynative = TICA(toydata, 5, backend='native')
+    toypyemma = TICA(toydata, 5)
+    assert np.allclose(toynative.tic.eigenvalues, toypyemma.tic.eigenvalues, atol=1e-4)
+    for a, b in zip(toynative.project(3).trajectories, toypyemma.project(3).trajectories):
+        assert np.allclose(np.abs(a.projection), np.abs(b.projection), rtol=0, atol=1e-3)
+    print('Native TICA matches pyemma on toy data.')
+
+    import tempfile
+    covfile = join(tempfile.mkdtemp(), 'covariances.dat')
+    firstdata = data.copy()
+    firstdata.dropTraj(idx=[1])
+    TICA(firstdata, 2, backend='native', covfile=covfile)
+    tica9 = TICA(data, 2, backend='native', covfile=covfile)
+    assert len(tica9.covariances.trajkeys) == 2
+    assert np.allclose(tica9.covariances.covariances(2)[2], ticanative.covariances.covariances(2)[2])
+    print('Incremental TICA covariances passed test.')
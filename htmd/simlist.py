@@ -257,7 +257,8 @@ def simfilter(sims, outfolder, filtersel, njobs=None):
 
     from htmd.config import _config
     from htmd.parallelprogress import ParallelExecutor, delayed
-    aprun = ParallelExecutor(n_jobs=njobs if njobs is not None else _config['njobs'])
+    cost = [len(s.trajectory) if s.numframes is None or None in s.numframes else sum(s.numframes) for s in sims]
+    aprun = ParallelExecutor(n_jobs=njobs if njobs is not None else _config['njobs'], cost=cost)
     filtsims = aprun(total=len(sims), desc='Filtering trajectories')(delayed(_filtSim)(i, sims, outfolder, filtersel) for i in range(len(sims)))
 
     logger.debug('Finished filtering of simulations')
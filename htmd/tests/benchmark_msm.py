@@ -0,0 +1,83 @@
+# (c) 2015-2018 Acellera Ltd http://www.acellera.com
+# All Rights Reserved
+# Distributed under HTMD Software License Agreement
+# No redistribution in whole or part
+#
+""" Benchmark of the native and the PyEMMA MSM estimation of Model
+
+Simulates discrete trajectories of a random metastable Markov chain and times Model.markovModel with both backends
+as well as the implied timescales of the native engine against pyemma.msm.its. The PyEMMA timings are skipped if it
+is not installed.
+
+Usage: python benchmark_msm.py [--states 500] [--trajectories 200] [--length 2000] [--macro 4] [--lag 5]
+"""
+import argparse
+import time
+import numpy as np
+
+
+def simulateChain(numstates, numtraj, length, nummacro, seed=0):
+    """ Discrete trajectories of a reversible Markov chain with `nummacro` weakly connected blocks of states """
+    rng = np.random.RandomState(seed)
+    K = rng.rand(numstates, numstates) * (rng.rand(numstates, numstates) < 0.1)
+    blocks = np.arange(numstates) * nummacro // numstates
+    K[blocks[:, None] != blocks[None, :]] *= 0.01
+    K += K.T + np.eye(numstates)
+    cumT = np.cumsum(K / K.sum(axis=1)[:, None], axis=1)
+    trajs = []
+    for _ in range(numtraj):
+        s = np.empty(length, dtype=int)
+        s[0] = rng.randint(numstates)
+        u = rng.rand(length)
+        for i in range(1, length):
+            s[i] = min(np.searchsorted(cumT[s[i - 1]], u[i]), numstates - 1)
+        trajs.append(s)
+    return trajs
+
+
+def timeit(func):
+    t = time.time()
+    res = func()
+    return time.time() - t, res
+
+
+if __name__ == '__main__':
+    from htmd.metricdata import MetricData
+    from htmd.model import Model
+    from htmd.clustering.kcenters import KCenter
+
+    parser = argparse.ArgumentParser(description='Benchmark of the native and the PyEMMA MSM estimation')
+    parser.add_argument('--states', type=int, default=500)
+    parser.add_argument('--trajectories', type=int, default=200)
+    parser.add_argument('--length', type=int, default=2000)
+    parser.add_argument('--macro', type=int, default=4)
+    parser.add_argument('--lag', type=int, default=5)
+    parser.add_argument('--njobs', type=int, default=1)
+    args = parser.parse_args()
+
+    trajs = simulateChain(args.states, args.trajectories, args.length, args.macro)
+    data = MetricData(dat=[t[:, None].astype(np.float32) for t in trajs], fstep=0.1)
+    data.cluster(KCenter(n_clusters=args.states))
+    lags = list(range(1, 4 * args.lag + 1, max(1, args.lag // 2)))
+    print('{} states, {} trajectories of {} frames'.format(data.K, args.trajectories, args.length))
+
+    # The first call compiles the numba kernels if they are not cached yet, so it is timed separately
+    model = Model(data)
+    compiletime, _ = timeit(lambda: model.markovModel(args.lag, args.macro, backend='native'))
+    model = Model(data)
+    nativetime, _ = timeit(lambda: model.markovModel(args.lag, args.macro, backend='native'))
+    print('markovModel native:      {:8.3f} s (first call {:.3f} s)'.format(nativetime, compiletime))
+    model = Model(data)
+    itstime, _ = timeit(lambda: model.impliedTimescales(lags, nits=5, njobs=args.njobs))
+    print('impliedTimescales native: {:7.3f} s for {} lags'.format(itstime, len(lags)))
+
+    try:
+        import pyemma.msm as msm
+    except ImportError:
+        print('PyEMMA is not installed. Skipping its timings.')
+    else:
+        model = Model(data)
+        pyemmatime, _ = timeit(lambda: model.markovModel(args.lag, args.macro, backend='pyemma'))
+        print('markovModel pyemma:      {:8.3f} s'.format(pyemmatime))
+        itstime, _ = timeit(lambda: msm.its(data.St.tolist(), lags=lags, nits=5, n_jobs=args.njobs))
+        print('implied timescales pyemma: {:6.3f} s for {} lags'.format(itstime, len(lags)))